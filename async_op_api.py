@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+"""An asyncio flavour of OpApi for fetching many items concurrently."""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import op_api
+
+
+class AsyncCommandExecutor(op_api.CommandStats):
+    """Runs op commands as asyncio subprocesses.
+
+    Keeps the same stats as CommandExecutor, but waits for a free slot and
+    for the process itself without tying up a thread per call.
+    """
+
+    def __init__(self, op_path="op", max_in_flight=64, timeout_seconds=60):
+        super().__init__()
+        self.op_path = op_path
+        self.max_in_flight = max_in_flight
+        self.timeout_seconds = timeout_seconds
+        # A Semaphore is bound to the loop that first waits on it, so each
+        # running loop gets its own, dropped once the loop is closed.
+        self.slots_lock = threading.Lock()
+        self.loop_slots = {}
+
+    def get_slots(self):
+        """Returns the semaphore that limits calls on the running loop."""
+        loop = asyncio.get_running_loop()
+        with self.slots_lock:
+            slots = self.loop_slots.get(loop)
+            if slots is None:
+                for closed_loop in [i for i in self.loop_slots if i.is_closed()]:
+                    del self.loop_slots[closed_loop]
+                slots = self.loop_slots[loop] = asyncio.Semaphore(self.max_in_flight)
+        return slots
+
+    async def run(
+        self,
+        args,
+        operation=op_api.READ_OPERATION,
+        timeout_seconds=None,
+        input_text=None,
+    ):
+        """Runs 'op <args>', feeding it input_text, and returns the result."""
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        argv = [self.op_path] + list(args)
+        async with self.get_slots():
+            start = self._start()
+            process = await asyncio.create_subprocess_exec(
+                *argv,
+                stdin=asyncio.subprocess.PIPE if input_text is not None else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(
+                        input_text.encode() if input_text is not None else None
+                    ),
+                    timeout=timeout_seconds,
+                )
+                result = subprocess.CompletedProcess(
+                    argv, process.returncode, stdout.decode(), stderr.decode()
+                )
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                result = subprocess.CompletedProcess(
+                    argv, -1, "", f"op timed out after {timeout_seconds}s"
+                )
+            self._record(operation, args, result.returncode, time.monotonic() - start)
+        return result
+
+
+class AsyncOpApi:
+    """Coroutine versions of the OpApi calls that fetch or change items.
+
+    Passing an existing OpApi shares its vault, on-disk cache and rate
+    budgets, and returns items that work with the rest of op_api (such as
+    DuplicateSet). Without one, a cache and rate limiter are opened here.
+    """
+
+    LIST_TIMEOUT_SECONDS = op_api.OpApi.LIST_TIMEOUT_SECONDS
+
+    def __init__(
+        self,
+        cache_dir="./.op-cache",
+        vault=None,
+        rate_budgets=None,
+        max_in_flight=64,
+        sync_api=None,
+        op_path="op",
+    ):
+        self.sync_api = sync_api
+        if sync_api is not None:
+            self.vault = sync_api.vault
+            self.item_store = sync_api.item_store
+            self.api_rate_limiter = sync_api.api_rate_limiter
+            self.retry_policy = sync_api.retry_policy
+        else:
+            self.vault = vault
+            if not os.path.exists(cache_dir):
+                os.mkdir(cache_dir)
+            self.item_store = op_api.ItemStore(f"{cache_dir}/op-cache.sqlite3")
+            self.api_rate_limiter = op_api.RateLimiter(rate_budgets)
+            self.retry_policy = op_api.RetryPolicy(
+                self.api_rate_limiter,
+                max_attempts=op_api.OpApi.MAX_ATTEMPTS,
+                backoff_base_seconds=op_api.OpApi.BACKOFF_BASE_SECONDS,
+                backoff_max_seconds=op_api.OpApi.BACKOFF_MAX_SECONDS,
+            )
+        if sync_api is not None:
+            op_path = sync_api.executor.op_path
+        self.executor = AsyncCommandExecutor(
+            op_path=op_path, max_in_flight=max_in_flight
+        )
+        self.items = None
+
+    async def run_command(
+        self,
+        args,
+        skip_cache=False,
+        cacheable=True,
+        vault_id=None,
+        timeout_seconds=None,
+        input_text=None,
+    ):
+        command = " ".join(args)
+        if cacheable and not skip_cache:
+            output = self.item_store.get_command_output(self.vault, command)
+            if output is not None:
+                logging.debug("Pulling from cache: %s", command)
+                return output
+
+        op_args = op_api.build_op_args(args, skip_cache, vault_id, self.vault)
+        output = await self._run_with_retries(
+            op_args,
+            op_api.get_operation_class(args),
+            timeout_seconds=timeout_seconds,
+            input_text=input_text,
+        )
+        if output and cacheable:
+            self.item_store.put_command_output(self.vault, command, output)
+        return output
+
+    async def _run_with_retries(
+        self, op_args, operation, timeout_seconds=None, input_text=None
+    ):
+        """Runs an op command, backing off and retrying on recoverable errors."""
+        for attempt in itertools.count():
+            await self.api_rate_limiter.acquire_async(operation)
+            logging.info("Calling API: op %s", " ".join(op_args))
+            result = await self.executor.run(
+                op_args,
+                operation=operation,
+                timeout_seconds=timeout_seconds,
+                input_text=input_text,
+            )
+            if result.returncode == 0:
+                self.retry_policy.record_success(operation)
+                return result.stdout
+            backoff = self.retry_policy.get_backoff(attempt, operation, result.stderr)
+            if backoff is None:
+                raise op_api.OpCommandError(
+                    " ".join(["op"] + op_args), result.returncode, result.stderr
+                )
+            await asyncio.sleep(backoff)
+
+    async def get_item_list(self, force_refresh=False):
+        if force_refresh or not self.item_store.has_listing(self.vault):
+            output = await self.run_command(
+                ["item", "list", "--format=json"],
+                skip_cache=force_refresh,
+                cacheable=False,
+                timeout_seconds=self.LIST_TIMEOUT_SECONDS,
+            )
+            self.item_store.replace_listing(self.vault, json.loads(output))
+        self.items = op_api.ItemList.from_store(
+            self.item_store.load_items(self.vault), op_api=self.sync_api
+        )
+        return self.items
+
+    async def get_item_details(self, item_id, force_refresh=False, vault_id=None):
+        if not force_refresh:
+            details = self.item_store.get_details(item_id)
+            if details is not None:
+                return op_api.ItemDetails.from_json(details, op_api=self.sync_api)
+        item = self._compact_details(
+            await self._get_plaintext_item(
+                item_id, force_refresh=force_refresh, vault_id=vault_id
+            )
+        )
+        self._store_details(item)
+        if force_refresh and self.sync_api is not None:
+            self.sync_api.apply_item_update(item)
+        return item
+
+    async def _get_plaintext_item(self, item_id, force_refresh=False, vault_id=None):
+        """Fetches one item's details from op without caching them."""
+        output = await self.run_command(
+            ["item", "get", item_id, "--format=json"],
+            skip_cache=force_refresh,
+            cacheable=False,
+            vault_id=vault_id,
+        )
+        try:
+            return op_api.ItemDetails.from_json(
+                output, op_api=self.sync_api, retain_serialized=True
+            )
+        except json.decoder.JSONDecodeError as error:
+            logging.error("Error while attempting to read: %s", item_id)
+            raise op_api.OpApiError(
+                f"Unreadable details for item {item_id}"
+            ) from error
+
+    def _store_details(self, item_details):
+        """Caches fetched details, then lets go of their JSON."""
+        self.item_store.put_details(item_details)
+        item_details.serialized = None
+
+    def _compact_details(self, item_details):
+        if self.sync_api is None:
+            return item_details
+        return self.sync_api.compact_details(item_details)
+
+    async def get_items_details(self, items, force_refresh=False):
+        """Fetches full details for many items at once, in the order given."""
+        return await asyncio.gather(
+            *[
+                self.get_item_details(
+                    item.item_id, force_refresh=force_refresh, vault_id=item.vault_id
+                )
+                for item in items
+            ]
+        )
+
+    async def archive_item(self, item_id):
+        logging.warning("Archiving item %s", item_id)
+        await self.run_command(
+            ["item", "delete", item_id, "--archive"], cacheable=False
+        )
+        self.item_store.delete_item(item_id)
+        if self.sync_api is not None:
+            self.sync_api.apply_item_removal(item_id)
+
+    async def update_item(self, item_details, fields):
+        """Applies all of 'fields' to an item in one edit and returns the result."""
+        if op_api.needs_edit_template(fields) and not (
+            item_details.has_plaintext() and item_details.serialized
+        ):
+            item_details = await self._get_plaintext_item(
+                item_details.item_id, vault_id=item_details.vault_id
+            )
+        command, input_text = op_api.get_update_command(item_details, fields)
+        output = await self.run_command(
+            command, cacheable=False, input_text=input_text
+        )
+        try:
+            item = self._compact_details(
+                op_api.ItemDetails.from_json(
+                    output, op_api=self.sync_api, retain_serialized=True
+                )
+            )
+        except (json.decoder.JSONDecodeError, KeyError):
+            logging.warning("Unreadable edit output, re-fetching %s.", command[2])
+            return await self.get_item_details(
+                item_details.item_id, force_refresh=True
+            )
+        self._store_details(item)
+        if self.sync_api is not None:
+            self.sync_api.apply_item_update(item)
+        return item
+
+    async def archive_items(self, items_to_archive):
+        """Archives many items concurrently, returning the ids that succeeded."""
+        results = await asyncio.gather(
+            *[self._archive_one(item) for item in items_to_archive]
+        )
+        archived_ids = [item_id for item_id in results if item_id is not None]
+        self.item_store.delete_items(archived_ids)
+        if self.sync_api is not None:
+            self.sync_api.apply_item_removals(archived_ids)
+        return archived_ids
+
+    async def _archive_one(self, item):
+        try:
+            await self.run_command(
+                ["item", "delete", item.item_id, "--archive"],
+                cacheable=False,
+                vault_id=item.vault_id,
+            )
+        except op_api.OpApiError as error:
+            logging.error("Failed to archive %s: %s", item.item_id, error)
+            return None
+        logging.warning("Archived item %s", item.item_id)
+        return item.item_id
@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+
+"""Offline benchmarks for op_api hot paths."""
+
+import argparse
+import concurrent.futures
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from urllib.parse import urlsplit
+
+import op_api
+import public_suffix
+
+
+def init_argparse():
+    parser = argparse.ArgumentParser(
+        description="Benchmark op_api without talking to 1Password."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[3, 10, 30, 100, 300, 1000, 3000],
+        help="Item counts to benchmark.",
+    )
+    parser.add_argument(
+        "--duplicate_ratio",
+        type=float,
+        default=0.2,
+        help="Fraction of items that should duplicate another item's domain.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Take the best of this many runs."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="Measure the memory held by parsed items instead of grouping time.",
+    )
+    parser.add_argument(
+        "--memory_sizes",
+        type=int,
+        nargs="+",
+        default=[10000, 50000, 100000],
+        help="Item counts for the memory benchmark.",
+    )
+    parser.add_argument(
+        "--suite",
+        action="store_true",
+        help="Time each hot path on a synthetic vault and print JSON results.",
+    )
+    parser.add_argument(
+        "--suite_sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Item counts for the suite.",
+    )
+    parser.add_argument(
+        "--suite_duplicate_ratios",
+        type=float,
+        nargs="+",
+        default=[0.2],
+        help="Duplicate ratios for the suite; every size is run with each.",
+    )
+    parser.add_argument(
+        "--output", type=str, help="Also write the suite's JSON results here."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="Earlier suite results to compare against; exits 1 on a regression.",
+    )
+    parser.add_argument(
+        "--max_slowdown",
+        type=float,
+        default=1.25,
+        help="How many times slower than the baseline a timing may be.",
+    )
+    parser.add_argument(
+        "--min_slowdown_seconds",
+        type=float,
+        default=0.005,
+        help="Ignore timings that slowed down by less than this many seconds.",
+    )
+    return parser
+
+
+def make_items(num_items, duplicate_ratio=0.2, seed=0):
+    """Builds list-skeleton ItemDetails spread over a synthetic set of domains."""
+    rng = random.Random(seed)
+    num_domains = max(1, int(num_items * (1 - duplicate_ratio)))
+    items = []
+    for i in range(num_items):
+        domain_number = i if i < num_domains else rng.randrange(num_domains)
+        url = f"https://www.site{domain_number}.example/login"
+        items.append(
+            op_api.ItemDetails(
+                f"item{i}",
+                fields={"title": f"Item {i}", "tags": [], "urls": [url]},
+                source=op_api.ItemDetails.JSON_LIST_SOURCE,
+                domains=op_api.get_domains_from_urls([url]),
+            )
+        )
+    return items
+
+
+def make_item_documents(num_items, duplicate_ratio=0.2, seed=0):
+    """Builds 'op item get --format=json' output for synthetic items, as bytes."""
+    documents = make_vault(num_items, duplicate_ratio=duplicate_ratio, seed=seed)
+    return [json.dumps(document).encode() for document in documents]
+
+
+def make_list_entry(document):
+    """Trims an item's details down to the entry 'op item list' shows for it."""
+    entry = {
+        key: document[key]
+        for key in (
+            "id",
+            "title",
+            "version",
+            "vault",
+            "category",
+            "last_edited_by",
+            "created_at",
+            "updated_at",
+            "additional_information",
+            "tags",
+            "urls",
+        )
+    }
+    return entry
+
+
+def make_vault(num_items, duplicate_ratio=0.2, seed=0):
+    """Builds synthetic 'op item get' details, as dicts.
+
+    A duplicate_ratio share of the items reuse another item's site, with
+    their own usernames and passwords, so they form scoreable sets.
+    """
+    rng = random.Random(seed)
+    num_domains = max(1, int(num_items * (1 - duplicate_ratio)))
+    documents = []
+    for i in range(num_items):
+        domain_number = i if i < num_domains else rng.randrange(num_domains)
+        username = f"user{rng.randrange(1000)}@example.com"
+        document = {
+            "id": f"item{i:08d}",
+            "title": f"Item {i}",
+            "version": 1,
+            "vault": {"id": "vault0000000000000000000000", "name": "Private"},
+            "category": "LOGIN",
+            "last_edited_by": "user00000000000000000000000",
+            "created_at": "2023-01-01T00:00:00Z",
+            "updated_at": f"2023-01-01T00:00:{i % 60:02d}Z",
+            "additional_information": username,
+            "tags": [],
+            "urls": [
+                {
+                    "primary": True,
+                    "href": f"https://www.site{domain_number}.example/login",
+                }
+            ],
+            "fields": [
+                {
+                    "id": "username",
+                    "type": "STRING",
+                    "purpose": "USERNAME",
+                    "label": "username",
+                    "value": username,
+                },
+                {
+                    "id": "password",
+                    "type": "CONCEALED",
+                    "purpose": "PASSWORD",
+                    "label": "password",
+                    "value": f"{rng.getrandbits(128):032x}",
+                    "password_details": {"strength": "FANTASTIC"},
+                },
+                {
+                    "id": "notesPlain",
+                    "type": "STRING",
+                    "purpose": "NOTES",
+                    "label": "notesPlain",
+                },
+            ],
+        }
+        documents.append(document)
+    return documents
+
+
+def find_duplicates_pairwise(items):
+    """The original all-pairs scan, kept as a reference for comparison."""
+    groups = []
+    duplicate_ids = set()
+    for i, details in enumerate(items):
+        if details.item_id in duplicate_ids or not details.has_domains():
+            continue
+        matching_items = [
+            j_details
+            for j_details in items[i + 1 :]
+            if j_details.item_id not in duplicate_ids
+            and j_details.is_duplicate(details)
+        ]
+        if matching_items:
+            groups.append([details] + matching_items)
+            duplicate_ids.update(item.item_id for item in groups[-1])
+    return groups
+
+
+def find_duplicates_indexed(items):
+    return op_api.DuplicateIndex(items).groups()
+
+
+def group_ids(groups):
+    return sorted(sorted(item.item_id for item in group) for group in groups)
+
+
+def benchmark_find_duplicates(sizes, duplicate_ratio=0.2, repeat=3, seed=0):
+    """Times both grouping strategies and reports where the index wins."""
+    crossover = None
+    print(f"{'items':>8} {'pairwise (s)':>14} {'indexed (s)':>14} {'speedup':>9}")
+    for size in sizes:
+        items = make_items(size, duplicate_ratio=duplicate_ratio, seed=seed)
+        if group_ids(find_duplicates_pairwise(items)) != group_ids(
+            find_duplicates_indexed(items)
+        ):
+            logging.error("Grouping mismatch at %s items.", size)
+            return 1
+        pairwise = min(
+            timeit.repeat(
+                lambda: find_duplicates_pairwise(items), number=1, repeat=repeat
+            )
+        )
+        indexed = min(
+            timeit.repeat(
+                lambda: find_duplicates_indexed(items), number=1, repeat=repeat
+            )
+        )
+        if indexed >= pairwise:
+            crossover = None
+        elif crossover is None:
+            crossover = size
+        speedup = pairwise / indexed
+        print(f"{size:>8} {pairwise:>14.6f} {indexed:>14.6f} {speedup:>8.1f}x")
+    if crossover is None:
+        print("The indexed grouping never overtook the pairwise scan.")
+    else:
+        print(f"Indexed grouping is faster from {crossover} items onward.")
+    return 0
+
+
+class DictItemDetails:
+    """ItemDetails as it was before it used slots, as a memory baseline.
+
+    Each item holds its own fields dict, domain set and details JSON.
+    """
+
+    def __init__(self, item_id, fields, serialized, domains, vault_id):
+        self.item_id = item_id
+        self.serialized = serialized
+        self.source = op_api.ItemDetails.JSON_SOURCE
+        self.fields = fields
+        self.domains = domains
+        self.op_api = None
+        self.vault_id = vault_id
+
+    @classmethod
+    def from_json(cls, serialized_json):
+        details = json.loads(serialized_json)
+        fields = {
+            "title": details.get("title", "Untitled"),
+            "tags": details.get("tags", []),
+            "urls": [i["href"] for i in details.get("urls", [])],
+            "vault": details["vault"]["name"],
+            "category": details["category"],
+            "updated_at": details["updated_at"],
+        }
+        for field in details["fields"]:
+            if field.get("value"):
+                fields[field.get("label") or field["id"]] = field["value"]
+        domains = frozenset(
+            public_suffix.get_registrable_domain(urlsplit(url).hostname or "")
+            for url in fields["urls"]
+        )
+        return cls(
+            details["id"], fields, serialized_json, domains, details["vault"]["id"]
+        )
+
+
+MEMORY_VARIANTS = {
+    "dict": lambda document: DictItemDetails.from_json(document),
+    "with_json": lambda document: op_api.ItemDetails.from_json(
+        document, retain_serialized=True
+    ),
+    "compact": lambda document: op_api.ItemDetails.from_json(document),
+}
+
+
+def measure_item_memory(size, variant, duplicate_ratio=0.2, seed=0):
+    """Returns the bytes still allocated after parsing a synthetic vault.
+
+    Caches that fill up per item, such as shared domain sets and field
+    layouts, are counted too, so the result depends on what was parsed
+    before it in the same process. Use measure_in_fresh_process to compare
+    variants. Only the public suffix list, a fixed cost, is loaded first.
+    """
+    documents = make_item_documents(size, duplicate_ratio=duplicate_ratio, seed=seed)
+    parse = MEMORY_VARIANTS[variant]
+    public_suffix.get_default_trie()
+    gc.collect()
+    tracemalloc.start()
+    items = [parse(document.decode()) for document in documents]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return allocated
+
+
+def measure_in_fresh_process(*args, **kwargs):
+    """Runs measure_item_memory in a new interpreter, with every cache cold."""
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(measure_item_memory, *args, **kwargs).result()
+
+
+def benchmark_memory(sizes, duplicate_ratio=0.2, seed=0):
+    """Reports the memory held by parsed items, against a dict-based baseline.
+
+    Each measurement runs in its own process, so none of them benefits
+    from caches that an earlier one warmed.
+    """
+    print(
+        f"{'items':>8} {'dict (MB)':>10} {'with JSON (MB)':>15} {'compact (MB)':>13} "
+        f"{'bytes/item':>11} {'saving':>7}"
+    )
+    for size in sizes:
+        allocated = {
+            variant: measure_in_fresh_process(
+                size, variant, duplicate_ratio=duplicate_ratio, seed=seed
+            )
+            for variant in MEMORY_VARIANTS
+        }
+        print(
+            f"{size:>8} {allocated['dict'] / 2**20:>10.1f} "
+            f"{allocated['with_json'] / 2**20:>15.1f} "
+            f"{allocated['compact'] / 2**20:>13.1f} "
+            f"{allocated['compact'] // size:>11} "
+            f"{allocated['dict'] / allocated['compact']:>6.1f}x"
+        )
+    return 0
+
+
+MIN_SAMPLE_SECONDS = 0.2
+CONFIRM_RUNS = 2
+
+
+def time_best(function, repeat, setup=None):
+    """Returns the best per-call time of 'repeat' samples.
+
+    Like timeit's autorange, each sample calls function until it has run for
+    at least MIN_SAMPLE_SECONDS, so fast paths aren't timed from a single
+    call that a stray context switch can double. setup runs untimed before
+    each call, and the garbage collector is held off while it's timed.
+    """
+    samples = []
+    for _ in range(repeat):
+        elapsed = 0
+        calls = 0
+        while elapsed < MIN_SAMPLE_SECONDS:
+            argument = setup() if setup else None
+            # As in timeit, so a collection of setup's garbage isn't timed.
+            gc.collect()
+            gc.disable()
+            try:
+                start = timeit.default_timer()
+                if setup:
+                    function(argument)
+                else:
+                    function()
+                elapsed += timeit.default_timer() - start
+            finally:
+                gc.enable()
+            calls += 1
+        samples.append(elapsed / calls)
+    return min(samples)
+
+
+def make_duplicate_sets(groups):
+    return [op_api.DuplicateSet(list(group)) for group in groups]
+
+
+def make_scoreable_sets(groups):
+    duplicate_sets = make_duplicate_sets(groups)
+    for duplicate_set in duplicate_sets:
+        duplicate_set.field_values  # pylint: disable=pointless-statement
+    return duplicate_sets
+
+
+def make_item_cache(cache_dir, documents):
+    """Fills an on-disk cache as if every item had been listed and fetched."""
+    item_store = op_api.ItemStore(os.path.join(cache_dir, "op-cache.sqlite3"))
+    item_store.replace_listing(None, [make_list_entry(doc) for doc in documents])
+    item_store.put_many_details(
+        [
+            op_api.ItemDetails.from_json(json.dumps(doc), retain_serialized=True)
+            for doc in documents
+        ]
+    )
+    return item_store
+
+
+def run_suite_case(size, duplicate_ratio, repeat=3, seed=0):
+    """Times every hot path for one synthetic vault, returning result records."""
+    documents = make_vault(size, duplicate_ratio=duplicate_ratio, seed=seed)
+    list_json = json.dumps([make_list_entry(document) for document in documents])
+    items = [op_api.ItemDetails.from_json(json.dumps(doc)) for doc in documents]
+    near_matcher = op_api.NearDuplicateMatcher()
+    groups = op_api.DuplicateIndex(items, near_matcher=near_matcher).groups()
+
+    timings = {
+        "item_list_from_json": time_best(
+            lambda: op_api.ItemList.from_json(list_json), repeat
+        ),
+        "find_duplicates": time_best(
+            lambda: op_api.DuplicateIndex(
+                items, near_matcher=near_matcher
+            ).duplicate_sets(),
+            repeat,
+        ),
+        "field_values": time_best(
+            lambda sets: [duplicate_set.field_values for duplicate_set in sets],
+            repeat,
+            setup=lambda: make_duplicate_sets(groups),
+        ),
+        "difference_score": time_best(
+            lambda sets: [duplicate_set.difference_score() for duplicate_set in sets],
+            repeat,
+            setup=lambda: make_scoreable_sets(groups),
+        ),
+    }
+    with tempfile.TemporaryDirectory() as cache_dir:
+        item_store = make_item_cache(cache_dir, documents)
+        timings["cache_load"] = time_best(
+            lambda: op_api.ItemList.from_store(item_store.load_items(None)), repeat
+        )
+        item_store.close()
+
+    return [
+        {
+            "benchmark": name,
+            "items": size,
+            "duplicate_ratio": duplicate_ratio,
+            "duplicate_sets": len(groups),
+            "seconds": seconds,
+        }
+        for name, seconds in timings.items()
+    ]
+
+
+def find_regressions(results, baseline, max_slowdown, min_slowdown_seconds=0):
+    """Returns the results that got more than max_slowdown times slower.
+
+    Results that slowed down by less than min_slowdown_seconds are ignored,
+    since a ratio alone flags jitter on timings of a few milliseconds.
+    """
+    baseline_seconds = {
+        (result["benchmark"], result["items"], result["duplicate_ratio"]): result[
+            "seconds"
+        ]
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in results:
+        key = (result["benchmark"], result["items"], result["duplicate_ratio"])
+        before = baseline_seconds.get(key)
+        if (
+            before
+            and result["seconds"] > before * max_slowdown
+            and result["seconds"] - before > min_slowdown_seconds
+        ):
+            regressions.append(dict(result, baseline_seconds=before))
+    return regressions
+
+
+def confirm_regressions(
+    results, baseline, repeat, seed, max_slowdown, min_slowdown_seconds
+):
+    """Re-times cases that look slower, keeping each benchmark's best time.
+
+    A slow patch on a shared machine can outlast every sample of a case,
+    but rarely several runs of it, so only slowdowns that persist through
+    CONFIRM_RUNS re-runs are left for find_regressions to report.
+    """
+    best = {
+        (result["benchmark"], result["items"], result["duplicate_ratio"]): result
+        for result in results
+    }
+    for _ in range(CONFIRM_RUNS):
+        suspects = sorted(
+            {
+                (regression["items"], regression["duplicate_ratio"])
+                for regression in find_regressions(
+                    best.values(), baseline, max_slowdown, min_slowdown_seconds
+                )
+            }
+        )
+        if not suspects:
+            break
+        for size, duplicate_ratio in suspects:
+            logging.info("Re-timing %s items at %s duplicates.", size, duplicate_ratio)
+            for result in run_suite_case(
+                size, duplicate_ratio, repeat=repeat, seed=seed
+            ):
+                key = (result["benchmark"], result["items"], result["duplicate_ratio"])
+                if result["seconds"] < best[key]["seconds"]:
+                    best[key] = result
+    return list(best.values())
+
+
+def benchmark_suite(
+    sizes,
+    duplicate_ratios,
+    repeat=3,
+    seed=0,
+    output_path=None,
+    baseline_path=None,
+    max_slowdown=1.25,
+    min_slowdown_seconds=0.005,
+):
+    """Runs the suite, printing JSON results and flagging regressions."""
+    results = []
+    for size in sizes:
+        for duplicate_ratio in duplicate_ratios:
+            logging.info("Timing %s items at %s duplicates.", size, duplicate_ratio)
+            results.extend(
+                run_suite_case(size, duplicate_ratio, repeat=repeat, seed=seed)
+            )
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        results = confirm_regressions(
+            results, baseline, repeat, seed, max_slowdown, min_slowdown_seconds
+        )
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if baseline is None:
+        return 0
+    regressions = find_regressions(
+        results, baseline, max_slowdown, min_slowdown_seconds
+    )
+    for regression in regressions:
+        logging.error(
+            "%s at %s items (%s duplicates) took %.4fs, up from %.4fs.",
+            regression["benchmark"],
+            regression["items"],
+            regression["duplicate_ratio"],
+            regression["seconds"],
+            regression["baseline_seconds"],
+        )
+    return 1 if regressions else 0
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s:%(levelname)s:%(message)s",
+        stream=sys.stderr,
+    )
+
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    if args.suite:
+        return benchmark_suite(
+            args.suite_sizes,
+            args.suite_duplicate_ratios,
+            repeat=args.repeat,
+            seed=args.seed,
+            output_path=args.output,
+            baseline_path=args.baseline,
+            max_slowdown=args.max_slowdown,
+            min_slowdown_seconds=args.min_slowdown_seconds,
+        )
+    if args.memory:
+        return benchmark_memory(
+            args.memory_sizes, duplicate_ratio=args.duplicate_ratio, seed=args.seed
+        )
+    return benchmark_find_duplicates(
+        args.sizes,
+        duplicate_ratio=args.duplicate_ratio,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,6 +28,12 @@ def init_argparse():
     parser.add_argument(
         "--num_in_set", type=int, default=1, help="How many items to put in each set."
     )
+    parser.add_argument(
+        "--op_path",
+        type=str,
+        default="op",
+        help="The 1Password CLI to run, such as ./fake_op.py for testing.",
+    )
     return parser
 
 
@@ -39,17 +45,24 @@ class DuplicateCreator:
     """
 
     def __init__(
-        self, vault, num_sets=1, num_in_set=1, template_path="./testing/login.json"
+        self,
+        vault,
+        num_sets=1,
+        num_in_set=1,
+        template_path="./testing/login.json",
+        op_path="op",
     ):
-        self.op_api = op_api.OpApi(vault=vault, call_interval_seconds=0.61)
+        self.op_api = op_api.OpApi(vault=vault, op_path=op_path)
         self.num_sets = num_sets
         self.num_in_set = num_in_set
         self.template_path = template_path
 
     def run(self):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.op_api.executor.max_in_flight
+        ) as executor:
             for i_set in range(0, self.num_sets):
-                url = f"https://{i_set}.example.com/"
+                url = f"https://set{i_set}.example/"
                 for i_item in range(0, self.num_in_set):
                     title = f"Item #{i_item} (set {i_set}) [op_dedupe testing]"
                     future = executor.submit(
@@ -58,6 +71,7 @@ class DuplicateCreator:
                         title=title,
                         url=url,
                     )
+        self.op_api.executor.log_stats()
 
 
 def main():
@@ -79,6 +93,7 @@ def main():
         num_sets=args.num_sets,
         num_in_set=args.num_in_set,
         template_path=args.template_path,
+        op_path=args.op_path,
     )
     tool.run()
 
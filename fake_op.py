@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+"""A stand-in for the 1Password CLI that serves a local fixture vault.
+
+Run op_dedupe with --op_path ./fake_op.py, or link this file onto PATH as
+'op'. Since op's own arguments are passed straight through, it's configured
+through the environment instead:
+
+    FAKE_OP_STATE            Vault file to serve and edit. Created on first use.
+    FAKE_OP_ITEMS            Item count for a newly created vault file.
+    FAKE_OP_DUPLICATE_RATIO  Share of a new vault's items that reuse a site.
+    FAKE_OP_LATENCY_SECONDS  Delay before each call, e.g. "0.2" or "0.1-0.5".
+    FAKE_OP_RATE_LIMITS      Requests per minute, e.g. "read=300,create=100".
+    FAKE_OP_RATE_LIMIT_RATE  Chance that a call is rate limited regardless.
+    FAKE_OP_FAILURE_RATE     Chance that a call fails with a transient error.
+
+'./fake_op.py init' writes a fresh vault file up front.
+"""
+
+import argparse
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+import benchmark
+import op_api
+
+DEFAULT_STATE_PATH = os.path.join(tempfile.gettempdir(), "fake-op-vault.json")
+DEFAULT_VAULT = {"id": "vault0000000000000000000000", "name": "Private"}
+RATE_WINDOW_SECONDS = 60
+VALUE_FLAGS = ("--vault", "--tags", "--url", "--title")
+
+
+def init_argparse():
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic vault for fake_op.py to serve."
+    )
+    parser.add_argument(
+        "--state",
+        type=str,
+        default=os.environ.get("FAKE_OP_STATE", DEFAULT_STATE_PATH),
+        help="Where to write the vault file.",
+    )
+    parser.add_argument(
+        "--items", type=int, default=100, help="How many items to create."
+    )
+    parser.add_argument(
+        "--duplicate_ratio",
+        type=float,
+        default=0.2,
+        help="Fraction of items that should duplicate another item's domain.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    return parser
+
+
+class FakeOpError(Exception):
+    """A failure to report on stderr the way op does."""
+
+
+def get_timestamp():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return now.isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+
+def make_id():
+    return "".join(random.choices(string.ascii_lowercase + string.digits, k=26))
+
+
+def get_latency_seconds(spec):
+    """Parses "0.2" or "0.1-0.5" into a delay, picked uniformly from a range."""
+    if not spec:
+        return 0
+    low, _, high = spec.partition("-")
+    return random.uniform(float(low), float(high or low))
+
+
+def parse_rate_limits(spec):
+    """Parses "read=300,edit=100" into per-operation budgets per minute."""
+    budgets = {}
+    for budget in filter(None, (spec or "").split(",")):
+        operation, _, per_minute = budget.partition("=")
+        budgets[operation.strip()] = int(per_minute)
+    return budgets
+
+
+class FakeVault:
+    """The vault file, plus the call log used for rate limiting.
+
+    Both are guarded by flock, so any number of fake op processes can share
+    them. The vault is replaced atomically, so readers never see half a write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.calls_path = f"{path}.calls"
+
+    @contextlib.contextmanager
+    def locked(self, lock_path, exclusive=True):
+        with open(lock_path, "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self):
+        with self.locked(f"{self.path}.lock", exclusive=False):
+            return self._load()
+
+    @contextlib.contextmanager
+    def editing(self):
+        """Yields the vault's items for changing, and saves them afterwards."""
+        with self.locked(f"{self.path}.lock"):
+            items = self._load()
+            yield items
+            self._save(items)
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as vault_file:
+            return json.load(vault_file)["items"]
+
+    def _save(self, items):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, delete=False, encoding="utf-8"
+        ) as vault_file:
+            json.dump({"items": items}, vault_file)
+        os.replace(vault_file.name, self.path)
+
+    def create(self, documents):
+        with self.locked(f"{self.path}.lock"):
+            self._save({document["id"]: document for document in documents})
+
+    def take_budget(self, operation, cost, per_minute):
+        """Records a call, unless it would overdraw the per-minute budget."""
+        with self.locked(f"{self.calls_path}.lock"):
+            try:
+                with open(self.calls_path, encoding="utf-8") as calls_file:
+                    calls = json.load(calls_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                calls = {}
+            window_start = time.time() - RATE_WINDOW_SECONDS
+            recent = [
+                call for call in calls.get(operation, []) if call[0] > window_start
+            ]
+            allowed = sum(call[1] for call in recent) + cost <= per_minute
+            if allowed:
+                recent.append([time.time(), cost])
+            calls[operation] = recent
+            with open(self.calls_path, "w", encoding="utf-8") as calls_file:
+                json.dump(calls, calls_file)
+        return allowed
+
+
+def split_args(args):
+    """Separates positional arguments from flags, dropping ones with no effect."""
+    positional = []
+    flags = {}
+    assignments = []
+    args = iter(args)
+    for arg in args:
+        if arg in VALUE_FLAGS:
+            flags[arg] = next(args, "")
+        elif arg.startswith("--"):
+            name, _, value = arg.partition("=")
+            flags[name] = value
+        elif "=" in arg or arg.endswith("[delete]"):
+            assignments.append(arg)
+        else:
+            positional.append(arg)
+    return positional, flags, assignments
+
+
+def to_list_entry(document):
+    return {key: value for key, value in document.items() if key != "fields"}
+
+
+def in_vault(document, vault):
+    return vault is None or vault in (
+        document["vault"]["id"],
+        document["vault"]["name"],
+    )
+
+
+def get_item(items, item_id, vault):
+    document = items.get(item_id)
+    if document is None or not in_vault(document, vault):
+        raise FakeOpError(
+            f'"{item_id}" isn\'t an item. Specify the item with its UUID, name, '
+            "or domain."
+        )
+    return document
+
+
+def set_field(document, label, value):
+    """Sets the labelled field's value, adding the field if needed, or deletes it."""
+    fields = []
+    for field in document["fields"]:
+        if (field.get("label") or field["id"]) == label:
+            if value is None:
+                continue
+            field["value"] = value
+            value = None
+        fields.append(field)
+    if value is not None:
+        fields.append({"id": label, "label": label, "type": "STRING", "value": value})
+    document["fields"] = fields
+
+
+def mark_edited(document):
+    document["additional_information"] = next(
+        (
+            field.get("value") or ""
+            for field in document["fields"]
+            if field.get("purpose") == "USERNAME" or field["id"] == "username"
+        ),
+        "",
+    )
+    document["version"] = document.get("version", 0) + 1
+    document["updated_at"] = get_timestamp()
+
+
+def list_items(vault_file, flags):
+    vault = flags.get("--vault")
+    print(
+        json.dumps(
+            [
+                to_list_entry(document)
+                for document in vault_file.read().values()
+                if in_vault(document, vault)
+            ]
+        )
+    )
+
+
+def get_items(vault_file, flags, positional, stdin_text):
+    items = vault_file.read()
+    vault = flags.get("--vault")
+    if positional[2] == "-":
+        for reference in json.loads(stdin_text):
+            document = get_item(items, reference["id"], reference["vault"]["id"])
+            print(json.dumps(document, indent=2))
+        return
+    document = get_item(items, positional[2], vault)
+    if "--share-link" in flags:
+        print(
+            "https://start.1password.com/open/i?a=FAKEACCOUNT"
+            f"&v={document['vault']['id']}&i={document['id']}&h=my.1password.com"
+        )
+    else:
+        print(json.dumps(document, indent=2))
+
+
+def edit_item(vault_file, flags, positional, assignments, stdin_text):
+    with vault_file.editing() as items:
+        document = get_item(items, positional[2], flags.get("--vault"))
+        if "--template" in flags:
+            template = json.loads(stdin_text)
+            for key in ("title", "urls", "tags", "fields"):
+                document[key] = template.get(key, [] if key != "title" else "")
+        if "--title" in flags:
+            document["title"] = flags["--title"]
+        if "--url" in flags:
+            document["urls"] = [{"primary": True, "href": flags["--url"]}]
+        if "--tags" in flags:
+            document["tags"] = list(filter(None, flags["--tags"].split(",")))
+        for assignment in assignments:
+            if assignment.endswith("[delete]"):
+                set_field(document, assignment[: -len("[delete]")], None)
+            else:
+                label, _, value = assignment.partition("=")
+                set_field(document, label, value)
+        mark_edited(document)
+    print(json.dumps(document, indent=2))
+
+
+def delete_item(vault_file, flags, positional):
+    with vault_file.editing() as items:
+        get_item(items, positional[2], flags.get("--vault"))
+        del items[positional[2]]
+
+
+def create_item(vault_file, flags):
+    with open(flags["--template"], encoding="utf-8") as template_file:
+        template = json.load(template_file)
+    with vault_file.editing() as items:
+        vaults = {
+            document["vault"]["name"]: document["vault"] for document in items.values()
+        }
+        vault = flags.get("--vault")
+        vault = vaults.get(vault) or (
+            {"id": make_id(), "name": vault} if vault else DEFAULT_VAULT
+        )
+        document = {
+            "id": make_id(),
+            "title": flags.get("--title") or template.get("title", ""),
+            "version": 0,
+            "vault": vault,
+            "category": template.get("category", "LOGIN"),
+            "last_edited_by": "FAKEUSER",
+            "created_at": get_timestamp(),
+            "tags": template.get("tags", []),
+            "urls": [],
+            "fields": template.get("fields", []),
+        }
+        if flags.get("--url"):
+            document["urls"] = [{"primary": True, "href": flags["--url"]}]
+        if "--generate-password" in flags:
+            for field in document["fields"]:
+                if field.get("purpose") == "PASSWORD":
+                    field["value"] = make_id()
+        mark_edited(document)
+        items[document["id"]] = document
+    print(json.dumps(document, indent=2))
+
+
+def load_vault_file():
+    """Opens the vault file, creating a synthetic one first if it's missing."""
+    vault_file = FakeVault(os.environ.get("FAKE_OP_STATE", DEFAULT_STATE_PATH))
+    if not os.path.exists(vault_file.path):
+        vault_file.create(
+            benchmark.make_vault(
+                int(os.environ.get("FAKE_OP_ITEMS", "100")),
+                duplicate_ratio=float(os.environ.get("FAKE_OP_DUPLICATE_RATIO", "0.2")),
+            )
+        )
+    return vault_file
+
+
+def inject_failures(vault_file, args, stdin_text):
+    """Sleeps, then raises the rate limit or transient errors configured."""
+    time.sleep(get_latency_seconds(os.environ.get("FAKE_OP_LATENCY_SECONDS")))
+    operation = op_api.get_operation_class(args)
+    cost = len(json.loads(stdin_text)) if args[:3] == ["item", "get", "-"] else 1
+    per_minute = parse_rate_limits(os.environ.get("FAKE_OP_RATE_LIMITS")).get(
+        operation
+    )
+    rate_limit_rate = float(os.environ.get("FAKE_OP_RATE_LIMIT_RATE", "0"))
+    if random.random() < rate_limit_rate or (
+        per_minute is not None
+        and not vault_file.take_budget(operation, cost, per_minute)
+    ):
+        raise FakeOpError("(429) Too many requests. Please try again later.")
+    if random.random() < float(os.environ.get("FAKE_OP_FAILURE_RATE", "0")):
+        raise FakeOpError("read: connection reset by peer")
+
+
+def run(args, stdin_text):
+    positional, flags, assignments = split_args(args)
+    vault_file = load_vault_file()
+    inject_failures(vault_file, positional, stdin_text)
+    command = positional[:2]
+    if command == ["item", "list"]:
+        list_items(vault_file, flags)
+    elif command == ["item", "get"]:
+        get_items(vault_file, flags, positional, stdin_text)
+    elif command == ["item", "edit"]:
+        edit_item(vault_file, flags, positional, assignments, stdin_text)
+    elif command == ["item", "delete"]:
+        delete_item(vault_file, flags, positional)
+    elif command == ["item", "create"]:
+        create_item(vault_file, flags)
+    else:
+        raise FakeOpError(f"unknown command \"{' '.join(positional)}\" for \"op\"")
+
+
+def main():
+    if sys.argv[1:2] == ["init"]:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="%(asctime)s:%(levelname)s:%(message)s",
+            stream=sys.stderr,
+        )
+        args = init_argparse().parse_args(sys.argv[2:])
+        FakeVault(args.state).create(
+            benchmark.make_vault(
+                args.items, duplicate_ratio=args.duplicate_ratio, seed=args.seed
+            )
+        )
+        logging.info("Wrote %s items to %s", args.items, args.state)
+        return 0
+
+    # Only edits that take a template and bulk gets read stdin.
+    stdin_text = ""
+    if "-" in sys.argv or "--template=/dev/stdin" in sys.argv:
+        stdin_text = sys.stdin.read()
+    try:
+        run(sys.argv[1:], stdin_text)
+    except FakeOpError as error:
+        timestamp = time.strftime("%Y/%m/%d %H:%M:%S")
+        sys.stderr.write(f"[ERROR] {timestamp} {error}\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
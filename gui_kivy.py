@@ -1,8 +1,9 @@
 """A Kivy-based GUI for the 1Password Deduplication Manager."""
 
 
-import concurrent.futures
+import bisect
 import logging
+import threading
 import webbrowser
 
 # pylint: disable=import-error
@@ -13,6 +14,7 @@ from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.uix.gridlayout import GridLayout
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.properties import ObjectProperty, StringProperty, BooleanProperty
 from kivy.uix.screenmanager import ScreenManager, Screen
 
@@ -27,74 +29,170 @@ SET_DETAILS_SCREEN_ID = "duplicate_set_details"
 PROGRESS_SCREEN_ID = "doing_stuff"
 EMPTY_SET_ID = "empty_set_screen"
 INITIAL_LOAD_SCREEN_ID = "initial_load_screen"
+STREAM_CANCEL_GROUP = "stream"
 
 
 class DedupeManager(ScreenManager):  # pylint: disable=too-few-public-methods
     """Deduplication Screen Manager."""
 
 
-def navigate_to_screen(screen_id, direction="right", refresh=False):
-    """Refreshes data within a screen and navigates there."""
+def run_in_background(work, on_done=None, on_error=None):
+    """Runs work() on a worker thread, then hands its result to the UI thread.
+
+    on_done(result), or on_error(error) if work() raised, is called from the
+    Kivy clock, so either can safely touch widgets.
+    """
+
+    def run():
+        try:
+            result = work()
+        except Exception as error:  # pylint: disable=broad-except
+            logging.exception("Background work failed: %s", error)
+            if on_error:
+                Clock.schedule_once(lambda unused_dt: on_error(error))
+            return
+        if on_done:
+            Clock.schedule_once(lambda unused_dt: on_done(result))
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def navigate_after(work, screen_id, direction="right", on_done=None, fallback_id=None):
+    """Shows progress while work() runs in the background, then navigates.
+
+    The result of work() is passed to on_done before the switch. If work()
+    fails, navigates to fallback_id instead, or to screen_id if there's none.
+    """
     screenmanager = App.get_running_app().manager
     screenmanager.transition.direction = direction
     screenmanager.transition.duration = 0.2
+    screenmanager.current = PROGRESS_SCREEN_ID
 
-    desired_screen = screenmanager.get_screen(screen_id)
-    if refresh:
-        screenmanager.current = PROGRESS_SCREEN_ID
+    def show(result):
+        if on_done:
+            on_done(result)
+        screenmanager.current = screen_id
+
+    def show_fallback(unused_error):
+        screenmanager.current = fallback_id or screen_id
+
+    run_in_background(work, show, on_error=show_fallback)
 
-        def refresh_and_navigate(unused_dt):
-            desired_screen.refresh()
-            screenmanager.current = screen_id
 
-        Clock.schedule_once(refresh_and_navigate, 0.25)
+def navigate_to_screen(screen_id, direction="right", refresh=False):
+    """Refreshes data within a screen and navigates there."""
+    screenmanager = App.get_running_app().manager
+    desired_screen = screenmanager.get_screen(screen_id)
+    if refresh:
+        navigate_after(
+            desired_screen.load_refreshed,
+            screen_id,
+            direction=direction,
+            on_done=desired_screen.show_refreshed,
+        )
         return
+    screenmanager.transition.direction = direction
+    screenmanager.transition.duration = 0.2
     screenmanager.current = screen_id
 
 
+def show_updated_list(direction="right"):
+    """Navigates to the set list, regrouping only what the last action changed.
+
+    Mutations keep the duplicate index up to date, so unlike a full refresh
+    this doesn't need to re-list the account.
+    """
+    screenmanager = App.get_running_app().manager
+    screenmanager.get_screen(LIST_SCREEN_ID).initialized = False
+    navigate_to_screen(LIST_SCREEN_ID, direction=direction, refresh=False)
+
+
 class EmptySetList(Screen):  # pylint: disable=too-few-public-methods
     """Page to display when there are no duplicates to show."""
 
 
-class ProgressScreen(Screen):  # pylint: disable=too-few-public-methods
-    """Transitional screen to give the impression of progress."""
+class ProgressReportingScreen(Screen):
+    """Base for screens showing what background work has done so far."""
+
+    progress_text = StringProperty()
+    update_event = None
+
+    def on_enter(self):
+        """Starts polling the load progress while the screen is shown."""
+        self.update_progress()
+        self.update_event = Clock.schedule_interval(self.update_progress, 0.5)
+
+    def on_leave(self):
+        """Stops polling once the work is done."""
+        self.stop_updates()
+
+    def stop_updates(self):
+        if self.update_event is not None:
+            self.update_event.cancel()
+            self.update_event = None
+
+    def update_progress(self, unused_dt=None):
+        self.progress_text = App.get_running_app().progress.describe()
 
 
-class InitialLoadScreen(Screen):  # pylint: disable=too-few-public-methods
+class ProgressScreen(ProgressReportingScreen):
+    """Transitional screen while a refresh runs in the background."""
+
+
+class InitialLoadScreen(ProgressReportingScreen):
     """Transitional screen during initial data fetch."""
 
-    def on_enter(self):  # pylint: disable=no-self-use
-        """Asynchronously fetches data when the load screen displays."""
+    def on_enter(self):
+        """Fetches data in the background when the load screen displays."""
+        super().on_enter()
 
-        def async_load(unused_dt):
-            duplicates = App.get_running_app().get_duplicates()
+        def show_list(duplicates):
             if duplicates:
+                App.get_running_app().stream_duplicates()
                 navigate_to_screen(LIST_SCREEN_ID, direction="up", refresh=False)
             else:
                 navigate_to_screen(EMPTY_SET_ID, direction="up", refresh=False)
 
-        Clock.schedule_once(async_load, 1.5)
+        def show_error(error):
+            self.stop_updates()
+            self.progress_text = f"Loading failed: {error}"
+
+        run_in_background(App.get_running_app().load, show_list, on_error=show_error)
 
 
-class ViewSetDetailsButton(Button):
+class ViewSetDetailsButton(RecycleDataViewBehavior, Button):
     """Button that, when clicked, navigates to a duplicate set details page."""
 
     selected_set = ObjectProperty(None)
 
+    def refresh_view_attrs(self, rv, index, data):
+        """Binds a recycled row to its set, building the label only when shown."""
+        super().refresh_view_attrs(rv, index, data)
+        self.text = self.get_display_text()
+
     def on_release(self):
         """Handles button click."""
         screenmanager = App.get_running_app().manager
         details_screen = screenmanager.get_screen(SET_DETAILS_SCREEN_ID)
         details_screen.selected_set = self.selected_set
-        screenmanager.transition.direction = "left"
-        screenmanager.transition.duration = 0.2
-        screenmanager.current = SET_DETAILS_SCREEN_ID
+        details_screen.plaintext_items = None
+        if all(item.has_plaintext() for item in self.selected_set.items):
+            navigate_to_screen(SET_DETAILS_SCREEN_ID, direction="left")
+            return
+        navigate_after(
+            self.selected_set.get_plaintext_items,
+            SET_DETAILS_SCREEN_ID,
+            direction="left",
+            on_done=details_screen.show_plaintext,
+            fallback_id=LIST_SCREEN_ID,
+        )
 
     def get_display_text(self):
         """Returns the button text for viewing a duplicate set."""
+        score = self.selected_set.get_cached_score()
         return "{name} (Score: {score})".format(
             name=self.selected_set.get_display_name(),
-            score=self.selected_set.difference_score(),
+            score="..." if score is None else score,
         )
 
 
@@ -102,39 +200,99 @@ class DuplicateSetList(Screen):
     """Page showing the list of all duplicate sets."""
 
     sets = ObjectProperty(None)
+    sort_keys = ObjectProperty(None)
     initialized = BooleanProperty(defaultvalue=False)
 
     def on_pre_enter(self):
         """Runs every time the screen loads."""
         self.populate_list()
+        app = App.get_running_app()
+        app.prefetcher.resume()
+        app.resume_streaming()
+
+    def on_pre_leave(self):  # pylint: disable=no-self-use
+        """Lets the next screen's requests skip past queued background fetches."""
+        app = App.get_running_app()
+        app.prefetcher.pause()
+        app.pause_streaming()
 
     def populate_list(self):
-        """Initializes and populates data within the set list screen."""
+        """Initializes and populates data within the set list screen.
+
+        Only the rows on screen exist as widgets; the RecycleView rebinds
+        them to other sets as the list scrolls.
+        """
         if self.initialized:
             return
-        self.ids.set_list_box.clear_widgets(children=self.ids.set_list_box.children)
+        self.show_sets(App.get_running_app().get_duplicates())
 
-        app = App.get_running_app()
-        self.sets = app.get_duplicates()
-        for this_set in self.sets:
-            button = ViewSetDetailsButton()
-            button.selected_set = this_set
-            button.text = button.get_display_text()
-            self.ids.set_list_box.add_widget(button)
+    def show_sets(self, duplicate_sets):
+        """Replaces the list with duplicate_sets, which are already sorted."""
+        self.sets = list(duplicate_sets)
+        self.sort_keys = [this_set.sort_key() for this_set in self.sets]
         self.initialized = True
-
-    def refresh(self):
-        """Refreshes the list screen with new data, bypassing cache."""
+        self.show_data()
+
+    def add_sets(self, duplicate_sets):
+        """Inserts newly scored sets into the list in score order."""
+        duplicate_index = App.get_running_app().op_api.duplicate_index
+        shown = {id(this_set) for this_set in self.sets}
+        for this_set in duplicate_sets:
+            if id(this_set) in shown:
+                continue
+            # Sets that changed since they were scored have been regrouped.
+            if duplicate_index is None or not duplicate_index.contains(this_set):
+                continue
+            sort_key = this_set.sort_key()
+            position = bisect.bisect_right(self.sort_keys, sort_key)
+            self.sort_keys.insert(position, sort_key)
+            self.sets.insert(position, this_set)
+        self.show_data()
+        self.refresh_labels(duplicate_sets)
+
+    def show_data(self):
+        self.ids.set_list_view.data = [
+            {"selected_set": this_set} for this_set in self.sets
+        ]
+        App.get_running_app().prefetcher.set_sets(self.sets)
+        Clock.schedule_once(lambda unused_dt: self.update_viewport())
+
+    def update_viewport(self):
+        """Tells the prefetcher which sets are currently on screen."""
+        set_list_view = self.ids.set_list_view
+        if not set_list_view.data:
+            return
+        row_height = set_list_view.layout_manager.default_size[1]
+        list_height = len(set_list_view.data) * row_height
+        hidden_height = max(0, list_height - set_list_view.height)
+        first_visible = int((1 - set_list_view.scroll_y) * hidden_height // row_height)
+        last_visible = first_visible + int(set_list_view.height // row_height) + 1
+        App.get_running_app().prefetcher.set_viewport(first_visible, last_visible)
+
+    def refresh_labels(self, duplicate_sets):
+        """Updates the rows of sets whose details have just been fetched."""
+        refreshed = {id(duplicate_set) for duplicate_set in duplicate_sets}
+        for row in self.ids.set_list_view.layout_manager.children:
+            if id(row.selected_set) in refreshed:
+                row.text = row.get_display_text()
+
+    def load_refreshed(self):  # pylint: disable=no-self-use
+        """Re-lists the account, bypassing cache. Runs off the UI thread."""
         app = App.get_running_app()
+        app.stop_streaming()
         app.op_api.refresh_item_ids()
-        self.initialized = False
-        self.populate_list()
+        return app.get_duplicates()
+
+    def show_refreshed(self, duplicate_sets):
+        self.show_sets(duplicate_sets)
 
 
 class DuplicateSetDetails(Screen):
     """Page showing the details of a particular duplicate set."""
 
     selected_set = ObjectProperty(None)
+    # The set's items with real values, when the cache only holds digests.
+    plaintext_items = ObjectProperty(None, allownone=True)
     populated_details = StringProperty()
 
     def clear_set_details(self):
@@ -155,6 +313,7 @@ class DuplicateSetDetails(Screen):
     def populate_set_details(self):
         """Populates the screen with item data from the duplicate set."""
         items = self.selected_set.items
+        display_items = self.plaintext_items or items
         column_count = len(items) + 1
         logging.info("Looking for %s columns", column_count)
         logging.info("Item ids: %s", [item.item_id for item in items])
@@ -179,14 +338,16 @@ class DuplicateSetDetails(Screen):
                 continue
             row = DataRow(cols=column_count)
             row.add_widget(RowHeaderCell(text=field_name))
-            row_values = [str(field_values[i][j]) for i in range(len(items))]
+            row_values = [
+                str(item.fields.get(field_name, "")) for item in display_items
+            ]
             for i, value in enumerate(row_values):
                 display_only = bool(field_name in op_api.UNIMPLEMENTED_FIELDS)
                 datacell = FieldDataCell(
                     field_name=field_name,
                     field_data=value,
                     selected_set=self.selected_set,
-                    selected_item=self.selected_set.items[i],
+                    selected_item=display_items[i],
                     for_display_only=display_only,
                 )
                 row.add_widget(datacell)
@@ -200,18 +361,30 @@ class DuplicateSetDetails(Screen):
         self.clear_set_details()
         self.populate_set_details()
 
-    def refresh(self):
-        """Refreshes the data on the page."""
-        app = App.get_running_app()
-        updated = []
-        for item in self.selected_set.items:
-            updated.append(
-                app.op_api.get_item_details(item.item_id, force_refresh=True)
-            )
-        self.selected_set = op_api.DuplicateSet(updated, op_api=app.op_api)
+    def on_leave(self):
+        """Forgets plaintext that was fetched only for showing this set."""
+        if self.plaintext_items is not None:
+            self.plaintext_items = None
+            self.clear_set_details()
+
+    def show_plaintext(self, plaintext_items):
+        self.plaintext_items = plaintext_items
         self.clear_set_details()
         self.populate_set_details()
 
+    def load_refreshed(self):
+        """Re-fetches the set's items, bypassing cache. Runs off the UI thread."""
+        app = App.get_running_app()
+        updated = app.op_api.get_items_details(
+            self.selected_set.items, force_refresh=True
+        )
+        duplicate_set = op_api.DuplicateSet(updated, op_api=app.op_api)
+        return duplicate_set, duplicate_set.get_plaintext_items()
+
+    def show_refreshed(self, refreshed):
+        self.selected_set, plaintext_items = refreshed
+        self.show_plaintext(plaintext_items)
+
 
 class DuplicateSetDetailsColumnHeader(
     BoxLayout
@@ -234,14 +407,8 @@ class ArchiveButton(IconButton):  # pylint: disable=too-few-public-methods
 
     def on_release(self):
         """Handles button click."""
-        navigate_to_screen(PROGRESS_SCREEN_ID, direction="right")
-
-        def archive_and_navigate(unused_dt):
-            item_id = self.selected_item.item_id
-            App.get_running_app().op_api.archive_item(item_id)
-            navigate_to_screen(LIST_SCREEN_ID, direction="right", refresh=True)
-
-        Clock.schedule_once(archive_and_navigate, 0.25)
+        App.get_running_app().journal.archive(self.selected_item)
+        show_updated_list(direction="right")
 
 
 class IgnoreSetButton(IconButton):  # pylint: disable=too-few-public-methods
@@ -251,14 +418,10 @@ class IgnoreSetButton(IconButton):  # pylint: disable=too-few-public-methods
 
     def on_release(self):
         """Handles button click."""
-        navigate_to_screen(PROGRESS_SCREEN_ID, direction="right")
-
-        def ignore_and_navigate(unused_dt):
-            items = self.selected_set.items
-            App.get_running_app().op_api.mark_as_multiprofile(items)
-            navigate_to_screen(LIST_SCREEN_ID, direction="right", refresh=True)
-
-        Clock.schedule_once(ignore_and_navigate, 0.25)
+        journal = App.get_running_app().journal
+        for item in self.selected_set.items:
+            journal.update(item, {"tags": [op_api.MULTIPROFILE_TAG]})
+        show_updated_list(direction="right")
 
 
 class RefreshButton(IconButton):  # pylint: disable=too-few-public-methods
@@ -288,7 +451,7 @@ class EmptyCacheButton(IconButton):  # pylint: disable=too-few-public-methods
 
     def on_release(self):  # pylint: disable=no-self-use
         """Handles button click."""
-        App.get_running_app().op_api.clear_entire_cache()
+        run_in_background(App.get_running_app().op_api.clear_entire_cache)
 
 
 class OpenLinkButton(IconButton):  # pylint: disable=too-few-public-methods
@@ -308,9 +471,13 @@ class OpenInOpButton(IconButton):  # pylint: disable=too-few-public-methods
 
     def on_release(self):
         """Handles button click."""
-        deeplink = self.selected_item.get_app_deeplink()
-        logging.info("Deeplink: %s", deeplink)
-        webbrowser.open_new_tab(deeplink)
+
+        def open_deeplink(deeplink):
+            logging.info("Deeplink: %s", deeplink)
+            webbrowser.open_new_tab(deeplink)
+
+        # Building the link runs an op command.
+        run_in_background(self.selected_item.get_app_deeplink, open_deeplink)
 
 
 class BackToListButton(IconButton):  # pylint: disable=too-few-public-methods
@@ -337,19 +504,29 @@ class CopyButton(IconButton):  # pylint: disable=too-few-public-methods
             self.selected_item.item_id,
             self.selected_set.get_display_name(),
         )
-        navigate_to_screen(PROGRESS_SCREEN_ID, direction="up")
-
-        def copy_and_navigate(unused_dt):
-            app = App.get_running_app()
-            for target_item in self.selected_set.items:
-                if target_item.item_id == self.selected_item.item_id:
-                    continue
-                app.op_api.copy_field_values(
-                    self.selected_item, target_item, [self.field_name]
-                )
-            navigate_to_screen(SET_DETAILS_SCREEN_ID, direction="up", refresh=True)
-
-        Clock.schedule_once(copy_and_navigate, 0.25)
+        app = App.get_running_app()
+        field_values = app.op_api.get_copied_field_values(
+            self.selected_item, [self.field_name]
+        )
+        updated_items = []
+        for target_item in self.selected_set.items:
+            if target_item.item_id != self.selected_item.item_id:
+                target_item = app.journal.update(target_item, field_values)
+            updated_items.append(target_item)
+        # The journal applies the edits in the background; show their results now.
+        details_screen = app.manager.get_screen(SET_DETAILS_SCREEN_ID)
+        details_screen.selected_set = op_api.DuplicateSet(
+            updated_items, op_api=app.op_api
+        )
+        if details_screen.plaintext_items is not None:
+            details_screen.plaintext_items = [
+                item
+                if item.item_id == self.selected_item.item_id
+                else item.with_updates(field_values)
+                for item in details_screen.plaintext_items
+            ]
+        details_screen.clear_set_details()
+        details_screen.populate_set_details()
 
 
 class HeaderRow(GridLayout):  # pylint: disable=too-few-public-methods
@@ -383,23 +560,125 @@ class FieldDataCell(BoxLayout):  # pylint: disable=too-few-public-methods
 class KivyGUI(App):
     """Controller for the Kivy Duplicate Manager GUI."""
 
-    def __init__(self, vault):
+    def __init__(
+        self,
+        vault,
+        sync=False,
+        prefetch_lookahead=30,
+        compact_cache=False,
+        domain_granularity=op_api.REGISTRABLE_DOMAIN_GRANULARITY,
+        near_duplicate_threshold=op_api.NEAR_DUPLICATE_THRESHOLD,
+        op_path="op",
+    ):
         super().__init__()
-        self.op_api = op_api.OpApi(vault=vault)
+        self.vault = vault
+        self.sync = sync
+        self.compact_cache = compact_cache
+        self.domain_granularity = domain_granularity
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.op_path = op_path
+        self.prefetch_lookahead = prefetch_lookahead
+        self.progress = op_api.LoadProgress()
+        self.op_api = None
+        self.journal = None
+        self.prefetcher = None
+        self.stream_generation = 0
+        self.streaming = False
+        self.stream_paused = False
         self.manager = DedupeManager()
         self.title = "1Password Duplicate Manager"
 
+    def load(self):
+        """Connects to 1Password and finds duplicates. Runs off the UI thread."""
+        self.op_api = op_api.OpApi(
+            vault=self.vault,
+            sync=self.sync,
+            progress=self.progress,
+            compact_cache=self.compact_cache,
+            domain_granularity=self.domain_granularity,
+            near_duplicate_threshold=self.near_duplicate_threshold,
+            op_path=self.op_path,
+        )
+        self.journal = op_api.MutationJournal(self.op_api)
+        self.journal.start()
+        self.prefetcher = op_api.DetailPrefetcher(
+            self.op_api,
+            lookahead=self.prefetch_lookahead,
+            on_hydrated=self.on_sets_hydrated,
+        )
+        return self.op_api.find_duplicates()
+
+    def stream_duplicates(self, clear=True):
+        """Fills the list screen with sets as they are scored, best first.
+
+        Sets with known scores arrive at once; the rest follow batch by
+        batch while their details are fetched in the background. Without
+        'clear', sets already on the list stay and aren't added again.
+        """
+        list_screen = self.manager.get_screen(LIST_SCREEN_ID)
+        if clear:
+            list_screen.show_sets([])
+        self.stream_generation += 1
+        self.streaming = True
+        generation = self.stream_generation
+
+        def add_batch(batch):
+            if generation == self.stream_generation:
+                list_screen.add_sets(batch)
+
+        def stream():
+            for batch in self.op_api.iter_scored_duplicates(
+                cancel_group=STREAM_CANCEL_GROUP
+            ):
+                if generation != self.stream_generation:
+                    return
+                Clock.schedule_once(lambda unused_dt, batch=batch: add_batch(batch))
+            if generation == self.stream_generation:
+                self.streaming = False
+
+        threading.Thread(target=stream, daemon=True).start()
+
+    def stop_streaming(self):
+        """Abandons a stream started by stream_duplicates."""
+        self.stream_generation += 1
+        self.streaming = False
+        self.stream_paused = False
+        self.op_api.scheduler.cancel(STREAM_CANCEL_GROUP)
+
+    def pause_streaming(self):
+        """Stops an unfinished stream while the list isn't on screen."""
+        if self.streaming:
+            self.stop_streaming()
+            self.stream_paused = True
+
+    def resume_streaming(self):
+        """Picks a paused stream back up, keeping the sets already listed."""
+        if self.stream_paused:
+            self.stream_paused = False
+            self.stream_duplicates(clear=False)
+
     def get_duplicates(self):
-        """Fetches and sorts the list of DuplicateSets for the account."""
+        """Finds and sorts the DuplicateSets for the account.
+
+        Sets that can be scored without fetching details are sorted by score;
+        the rest follow and are hydrated by the prefetcher as they scroll
+        into view.
+        """
         duplicates = self.op_api.find_duplicates()
         if not duplicates:
             return []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
-            for dup_set in duplicates:
-                if dup_set.has_full_details():
-                    continue
-                future = executor.submit(dup_set.force_full_details)
-        return sorted(duplicates, key=lambda x: x.difference_score())
+
+        duplicates = sorted(duplicates, key=op_api.DuplicateSet.sort_key)
+        self.op_api.score_cache.flush()
+        return duplicates
+
+    def on_sets_hydrated(self, duplicate_sets):
+        """Called from the prefetch thread once sets have full details."""
+
+        def refresh_labels(unused_dt):
+            self.manager.get_screen(LIST_SCREEN_ID).refresh_labels(duplicate_sets)
+
+        Clock.schedule_once(refresh_labels)
 
     def build(self):
         """Builds the initial set of app screens."""
@@ -411,3 +690,10 @@ class KivyGUI(App):
         self.manager.add_widget(DuplicateSetDetails(name=SET_DETAILS_SCREEN_ID))
         navigate_to_screen(INITIAL_LOAD_SCREEN_ID, direction="up", refresh=False)
         return self.manager
+
+    def on_stop(self):
+        """Logs how long op calls queued and ran, for tuning."""
+        if self.op_api is None:
+            return
+        self.op_api.scheduler.log_stats()
+        self.op_api.executor.log_stats()
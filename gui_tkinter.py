@@ -10,8 +10,23 @@ import op_api
 class TkinterGUI:
     """Controller for the Tkinter Duplicate Manager GUI."""
 
-    def __init__(self, vault):
-        self.op_api = op_api.OpApi(vault=vault)
+    def __init__(
+        self,
+        vault,
+        sync=False,
+        compact_cache=False,
+        domain_granularity=op_api.REGISTRABLE_DOMAIN_GRANULARITY,
+        near_duplicate_threshold=op_api.NEAR_DUPLICATE_THRESHOLD,
+        op_path="op",
+    ):
+        self.op_api = op_api.OpApi(
+            vault=vault,
+            sync=sync,
+            compact_cache=compact_cache,
+            domain_granularity=domain_granularity,
+            near_duplicate_threshold=near_duplicate_threshold,
+            op_path=op_path,
+        )
         self.create_root()
         self.infocus_duplicate_set = None
         self.copy_vars = []
@@ -49,9 +64,10 @@ class TkinterGUI:
 
         # Create checkboxes for selecting fields to copy
         self.copy_vars = []
+        source_item = duplicate_set.get_plaintext_items()[source_i]
         for i, field_name in enumerate(duplicate_set.field_names):
             tk.Label(inner_frame, text=field_name).grid(row=i + 1, column=0)
-            values = duplicate_set.field_values[source_i][i]
+            values = source_item.fields.get(field_name, "")
             if isinstance(values, list):
                 values = ", ".join(values)
             tk.Label(inner_frame, text=values).grid(row=i + 1, column=1)
@@ -109,6 +125,7 @@ class TkinterGUI:
         items = duplicate_set.items
         field_names = duplicate_set.field_names
         field_values = duplicate_set.field_values
+        display_items = duplicate_set.get_plaintext_items()
         archive_vars = [tk.BooleanVar(value=False) for item in items]
         multiprofile_vars = [tk.BooleanVar(value=False) for item in items]
 
@@ -192,7 +209,7 @@ class TkinterGUI:
                 for i in range(len(duplicate_set.items)):
                     row_cell = tk.Frame(row_frame, relief=tk.RIDGE, borderwidth=1)
                     row_cell.pack(side="left", fill="both", expand=True)
-                    field_value = field_values[i][j]
+                    field_value = display_items[i].fields.get(field_name, "")
                     label = tk.Label(row_cell, text=field_value)
                     label.pack(side="top", fill="both", expand=True)
 
@@ -223,7 +240,9 @@ class TkinterGUI:
             messagebox.showinfo("No Duplicates Found", "No duplicate items were found.")
             return
 
-        for duplicate_set in sorted(duplicates, key=lambda x: x.difference_score()):
+        duplicates = sorted(duplicates, key=lambda x: x.difference_score())
+        self.op_api.score_cache.flush()
+        for duplicate_set in duplicates:
             button_text = (
                 f"{duplicate_set.difference_score()}: "
                 f"{duplicate_set.get_display_name()}"
@@ -1,58 +1,1314 @@
 #!/usr/bin/env python3
 
+import array
+import asyncio
+import codecs
 import collections
+import concurrent.futures
+import datetime
+import functools
+import glob
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
 import logging
+import operator
 import os
-import pickle
-import shutil
+import queue
+import random
+import re
+import sqlite3
+import subprocess
 import sys
 import threading
 import time
 
 from functools import cached_property
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import parse_qs, urlparse, urlsplit
+
+import public_suffix
 
 MULTIPROFILE_TAG = "ignored_by_op_dedupe"
-UNIMPLEMENTED_FIELDS = frozenset(["vault"])
+# How finely URLs are told apart when grouping: by full host name, or by the
+# registrable domain (eTLD+1), so that login.example.com matches example.com.
+HOST_GRANULARITY = "host"
+REGISTRABLE_DOMAIN_GRANULARITY = "registrable_domain"
+DOMAIN_GRANULARITIES = (REGISTRABLE_DOMAIN_GRANULARITY, HOST_GRANULARITY)
+URL_CACHE_SIZE = 1 << 17
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Distinct domain sets and field-name layouts shared between items. Past
+# this, the least recently used stop being shared, so memory stays bounded.
+DOMAIN_SET_CACHE_SIZE = 1 << 16
+FIELD_LAYOUT_CACHE_SIZE = 1 << 12
+# Items without URLs are grouped when their estimated similarity reaches this.
+# 0 leaves them ungrouped, which is the default until it's been tried on more
+# vaults; NearDuplicateMatcher.DEFAULT_THRESHOLD is a sensible value to opt in.
+NEAR_DUPLICATE_THRESHOLD = 0
+WHITESPACE = re.compile(r"\s*")
+# What may still follow a number's last digit before the buffer runs out.
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*\Z")
+# op derives additional_information (a login's username, say) from other fields.
+UNIMPLEMENTED_FIELDS = frozenset(["vault", "additional_information"])
+# Fields that also appear in item listings, so they're kept as-is in compact mode.
+DISPLAY_SAFE_FIELDS = frozenset(
+    [
+        "title",
+        "tags",
+        "urls",
+        "vault",
+        "category",
+        "updated_at",
+        "additional_information",
+    ]
+)
+
+
+READ_OPERATION = "read"
+EDIT_OPERATION = "edit"
+CREATE_OPERATION = "create"
+ARCHIVE_OPERATION = "archive"
+
+# Lower values are scheduled first.
+INTERACTIVE_PRIORITY = 0
+BACKGROUND_PRIORITY = 1
+PRIORITY_NAMES = {
+    INTERACTIVE_PRIORITY: "interactive",
+    BACKGROUND_PRIORITY: "background",
+}
+
+# (limit, window in seconds) pairs for each operation class, kept just under
+# the limits described in the OpApi docstring.
+DEFAULT_RATE_BUDGETS = {
+    READ_OPERATION: [(290, 60), (14500, 3600)],
+    EDIT_OPERATION: [(95, 60), (2900, 3600)],
+    CREATE_OPERATION: [(95, 60), (250, 3600)],
+    ARCHIVE_OPERATION: [(95, 60), (2900, 3600)],
+}
+
+
+# op prints the HTTP status in parentheses ahead of the server's message,
+# e.g. "(429) Too Many Requests", and network failures with Go's wording.
+# The patterns stick to those forms because stderr also echoes item names
+# and IDs, which can contain anything.
+RATE_LIMIT_PATTERN = re.compile(r"\(429\)|\btoo many requests\b", re.IGNORECASE)
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r"\((?:500|502|503|504)\)"
+    r"|\b(?:internal server error|bad gateway|service unavailable"
+    r"|gateway timeout)\b"
+    r"|\b(?:i/o|tls handshake) timeout\b"
+    r"|\bcontext deadline exceeded\b"
+    r"|\bconnection (?:reset by peer|refused)\b"
+    r"|\bunexpected eof\b"
+    r"|\bresource temporarily unavailable\b"
+    r"|^op timed out after\b",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+class OpApiError(Exception):
+    """Raised when the op CLI can't give us a usable answer."""
+
+
+class OpCommandError(OpApiError):
+    """Raised when an op command fails and retrying won't help."""
+
+    def __init__(self, command, returncode, stderr):
+        super().__init__(f"'{command}' exited with {returncode}: {stderr.strip()}")
+        self.command = command
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class RequestCancelled(OpApiError):
+    """Raised when queued background work is cancelled before it runs."""
+
+
+def is_rate_limit_error(stderr):
+    return RATE_LIMIT_PATTERN.search(stderr) is not None
+
+
+def is_transient_error(stderr):
+    return TRANSIENT_ERROR_PATTERN.search(stderr) is not None
+
+
+def get_backoff_seconds(attempt, base_seconds=1, max_seconds=60):
+    """Exponential backoff with full jitter for the given retry attempt."""
+    return random.uniform(0, min(max_seconds, base_seconds * 2**attempt))
+
+
+def build_op_args(args, skip_cache=False, vault_id=None, default_vault=None):
+    """Appends the cache and vault flags that every op call shares."""
+    op_args = list(args)
+    if not skip_cache:
+        op_args.append("--cache")
+    if vault_id:
+        op_args += ["--vault", vault_id]
+    elif default_vault:
+        op_args += ["--vault", default_vault]
+    return op_args
+
+
+def get_operation_class(args):
+    """Maps an op command's arguments to the rate budget it draws from."""
+    words = list(args[:2])
+    if words == ["item", "edit"]:
+        return EDIT_OPERATION
+    if words == ["item", "create"]:
+        return CREATE_OPERATION
+    if words == ["item", "delete"]:
+        return ARCHIVE_OPERATION
+    return READ_OPERATION
+
+
+class TokenBucket:
+    """Allows at most 'limit' tokens in any 'window_seconds' window.
+
+    Up to 'burst' tokens can be spent at once, and the rest trickle in evenly
+    across the window, so bursts plus steady refill never exceed the limit.
+    """
 
+    def __init__(self, limit, window_seconds, burst=None):
+        if burst is None:
+            burst = max(1, limit // 10)
+        self.capacity = burst
+        self.refill_rate = max(limit - burst, 1) / window_seconds
+        self.max_refill_rate = self.refill_rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.refill_rate
+        )
+        self.updated = now
+
+    def reserve(self, now, cost=1):
+        """Takes 'cost' tokens, returning how long to wait before using them."""
+        self.refill(now)
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.refill_rate
+
+    def estimate_wait(self, now, cost=1):
+        """Like reserve, but only predicts the wait without taking tokens."""
+        tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.refill_rate
+        )
+        return max(0, cost - tokens) / self.refill_rate
 
-class RateLimiter(collections.Iterator):
-    """Iterator that yields a value at most once every 'interval' seconds."""
+    def slow_down(self, factor=0.75):
+        """Drains the bucket and refills more slowly after hitting a real limit."""
+        self.refill_rate *= factor
+        self.tokens = min(self.tokens, 0)
 
-    # Hat tip: https://stackoverflow.com/a/20644609/757873
-    def __init__(self, interval):
+    def speed_up(self, step=0.01):
+        """Creeps back towards the configured rate after a successful call."""
+        self.refill_rate = min(
+            self.max_refill_rate, self.refill_rate + self.max_refill_rate * step
+        )
+
+
+class RateLimiter:
+    """Token-bucket rate limiter with separate budgets per operation class."""
+
+    def __init__(self, budgets=None):
         self.lock = threading.Lock()
-        self.interval = interval
-        self.next_yield = 0
+        self.buckets = {
+            operation: [TokenBucket(limit, window) for limit, window in windows]
+            for operation, windows in (budgets or DEFAULT_RATE_BUDGETS).items()
+        }
 
-    def __next__(self):
+    def reserve(self, operation=READ_OPERATION, cost=1):
+        """Claims budget for a call, returning how long to wait before making it."""
         with self.lock:
             now = time.monotonic()
-            if now < self.next_yield:
-                time.sleep(self.next_yield - now)
-                now = time.monotonic()
-            self.next_yield = now + self.interval
+            wait = max(
+                [bucket.reserve(now, cost) for bucket in self.buckets[operation]]
+            )
+        if wait:
+            logging.debug("Rate limiting %s call for %.2fs", operation, wait)
+        return wait
 
+    def estimate_wait(self, operation=READ_OPERATION, cost=1):
+        """Predicts how long 'cost' more calls would take under current budgets."""
+        with self.lock:
+            now = time.monotonic()
+            return max(
+                bucket.estimate_wait(now, cost) for bucket in self.buckets[operation]
+            )
+
+    def take_available(self, operation=READ_OPERATION, cost=1):
+        """Takes up to 'cost' whole tokens that every budget can spare right now.
+
+        Unlike reserve, this never goes into debt, so a large request can be
+        paid for a little at a time without holding up anything behind it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            buckets = self.buckets[operation]
+            for bucket in buckets:
+                bucket.refill(now)
+            taken = max(0, min(cost, min(int(bucket.tokens) for bucket in buckets)))
+            for bucket in buckets:
+                bucket.tokens -= taken
+        return taken
+
+    def refund(self, operation=READ_OPERATION, tokens=1):
+        """Returns tokens taken for a request that will never be made."""
+        with self.lock:
+            for bucket in self.buckets[operation]:
+                bucket.tokens = min(bucket.capacity, bucket.tokens + tokens)
+
+    def acquire(self, operation=READ_OPERATION, cost=1):
+        """Blocks until every budget for 'operation' has room for another call."""
+        wait = self.reserve(operation, cost)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, operation=READ_OPERATION, cost=1):
+        """Like acquire, but yields to the event loop instead of blocking."""
+        wait = self.reserve(operation, cost)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def record_rate_limited(self, operation=READ_OPERATION):
+        with self.lock:
+            for bucket in self.buckets[operation]:
+                bucket.slow_down()
+            logging.warning(
+                "Rate limited on %s calls, slowing to %.2f calls/s.",
+                operation,
+                min(bucket.refill_rate for bucket in self.buckets[operation]),
+            )
+
+    def record_success(self, operation=READ_OPERATION):
+        with self.lock:
+            for bucket in self.buckets[operation]:
+                bucket.speed_up()
+
+
+class RetryPolicy:
+    """Decides whether, and after how long, a failed op command is retried.
+
+    Failures are also reported to the rate limiter, so a rate limit error
+    slows every caller down, not just the one that hit it.
+    """
+
+    def __init__(
+        self,
+        rate_limiter,
+        max_attempts=6,
+        backoff_base_seconds=1,
+        backoff_max_seconds=60,
+    ):
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+
+    def record_success(self, operation):
+        self.rate_limiter.record_success(operation)
+
+    def get_backoff(self, attempt, operation, stderr):
+        """Returns how long to wait before retrying, or None to give up."""
+        if is_rate_limit_error(stderr):
+            self.rate_limiter.record_rate_limited(operation)
+        elif not is_transient_error(stderr):
+            return None
+        if attempt + 1 >= self.max_attempts:
+            return None
+        backoff = get_backoff_seconds(
+            attempt, self.backoff_base_seconds, self.backoff_max_seconds
+        )
+        logging.warning("Retrying in %.1fs after error: %s", backoff, stderr.strip())
+        return backoff
+
+
+class CommandStats:
+    """Per-operation call counts and latencies, for tuning parallelism."""
+
+    LATENCY_SAMPLES = 500
+
+    def __init__(self):
+        self.stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = collections.Counter()
+        self.failures = collections.Counter()
+        self.latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.LATENCY_SAMPLES)
+        )
+
+    def _start(self):
+        with self.stats_lock:
+            self.in_flight += 1
+        return time.monotonic()
+
+    def _record(self, operation, args, returncode, latency):
+        with self.stats_lock:
+            self.in_flight -= 1
+            self.calls[operation] += 1
+            if returncode != 0:
+                self.failures[operation] += 1
+            self.latencies[operation].append(latency)
+        logging.debug("%s call took %.3fs: %s", operation, latency, " ".join(args))
+
+    def stats(self):
+        """Returns call counts and recent latency figures per operation class."""
+        with self.stats_lock:
+            stats = {}
+            for operation, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                stats[operation] = {
+                    "calls": self.calls[operation],
+                    "failures": self.failures[operation],
+                    "mean_seconds": sum(ordered) / len(ordered),
+                    "p95_seconds": ordered[int(0.95 * (len(ordered) - 1))],
+                    "max_seconds": ordered[-1],
+                }
+            return stats
+
+    def log_stats(self):
+        for operation, stats in sorted(self.stats().items()):
+            logging.info(
+                "%s: %s calls, %s failed, mean %.2fs, p95 %.2fs, max %.2fs",
+                operation,
+                stats["calls"],
+                stats["failures"],
+                stats["mean_seconds"],
+                stats["p95_seconds"],
+                stats["max_seconds"],
+            )
+
+
+class CommandExecutor(CommandStats):
+    """Runs op commands as argument vectors, without a shell.
+
+    At most 'max_in_flight' op processes run at once, each call is killed
+    after its timeout, and per-operation latency is recorded so parallelism
+    can be tuned against the rate limiter.
+    """
+
+    def __init__(self, op_path="op", max_in_flight=8, timeout_seconds=60):
+        super().__init__()
+        self.op_path = op_path
+        self.max_in_flight = max_in_flight
+        self.timeout_seconds = timeout_seconds
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+
+    def run(
+        self, args, operation=READ_OPERATION, timeout_seconds=None, input_text=None
+    ):
+        """Runs 'op <args>', feeding it input_text on stdin, and returns the result.
+
+        Timeouts are reported as a failed process rather than raised, so
+        callers can treat them like any other transient error.
+        """
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        argv = [self.op_path] + list(args)
+        with self.slots:
+            start = self._start()
+            try:
+                result = subprocess.run(
+                    argv,
+                    input=input_text,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout_seconds,
+                    check=False,
+                )
+            except subprocess.TimeoutExpired:
+                result = subprocess.CompletedProcess(
+                    argv, -1, "", f"op timed out after {timeout_seconds}s"
+                )
+            self._record(operation, args, result.returncode, time.monotonic() - start)
+        return result
+
+    def stream(
+        self,
+        args,
+        operation=READ_OPERATION,
+        timeout_seconds=None,
+        chunk_size=64 * 1024,
+    ):
+        """Runs 'op <args>', yielding its stdout as text while it arrives.
+
+        Unlike run, a failure is raised as OpCommandError once the output
+        ends, since part of it may already have been consumed. The timeout
+        covers the whole run, and the slot is held until the output ends or
+        the generator is closed.
+        """
+        timeout_seconds = timeout_seconds or self.timeout_seconds
+        argv = [self.op_path] + list(args)
+        with self.slots:
+            start = self._start()
+            process = subprocess.Popen(
+                argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            timer = threading.Timer(timeout_seconds, process.kill)
+            timer.start()
+            # Drained on the side so a chatty stderr can't stall stdout.
+            stderr_chunks = []
+            stderr_reader = threading.Thread(
+                target=lambda: stderr_chunks.append(process.stderr.read()),
+                daemon=True,
+            )
+            stderr_reader.start()
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            try:
+                while True:
+                    chunk = process.stdout.read1(chunk_size)
+                    if not chunk:
+                        break
+                    yield decoder.decode(chunk)
+                yield decoder.decode(b"", final=True)
+                returncode = process.wait()
+            finally:
+                timer.cancel()
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+                    returncode = process.returncode
+                stderr_reader.join()
+                process.stdout.close()
+                process.stderr.close()
+                self._record(
+                    operation, args, process.returncode, time.monotonic() - start
+                )
+        if returncode != 0:
+            stderr = b"".join(stderr_chunks).decode(errors="replace")
+            if not timer.is_alive() and time.monotonic() - start >= timeout_seconds:
+                stderr = f"op timed out after {timeout_seconds}s"
+            raise OpCommandError(" ".join(argv), returncode, stderr)
+
+
+class CommandScheduler:
+    """Priority queue in front of the command layer.
+
+    Requests wait here until one of 'workers' threads is free and, given a
+    rate_limiter, until their operation's budget can pay for them. Both go
+    to interactive requests ahead of background ones, and otherwise first
+    come, first served. A request costing more than the budget has on hand
+    collects tokens while it waits, but gives way to any higher priority
+    request of the same operation that arrives meanwhile, so a bulk fetch
+    never leaves debt for an interactive call to wait behind. Queued
+    background requests can be tagged with a cancel group so work for a
+    screen the user has left can be dropped in one call, refunding whatever
+    it had been paid.
+    """
 
-def get_domain_from_url(url):
+    WAIT_SAMPLES = 500
+
+    def __init__(self, workers=8, rate_limiter=None):
+        self.rate_limiter = rate_limiter
+        self.condition = threading.Condition()
+        self.queue = []
+        self.paid = {}
+        self.sequence = itertools.count()
+        self.waits = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.WAIT_SAMPLES)
+        )
+        self.cancelled = collections.Counter()
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(
+        self,
+        function,
+        priority=INTERACTIVE_PRIORITY,
+        cancel_group=None,
+        operation=None,
+        cost=0,
+    ):
+        """Queues function() to run on a worker, returning a Future for it.
+
+        With an operation, it only starts once 'cost' tokens of that
+        operation's rate budget have been paid for it.
+        """
+        future = concurrent.futures.Future()
+        with self.condition:
+            heapq.heappush(
+                self.queue,
+                (
+                    priority,
+                    next(self.sequence),
+                    time.monotonic(),
+                    cancel_group,
+                    operation,
+                    cost,
+                    function,
+                    future,
+                ),
+            )
+            self.condition.notify()
+        return future
+
+    def run(
+        self,
+        function,
+        priority=INTERACTIVE_PRIORITY,
+        cancel_group=None,
+        operation=None,
+        cost=0,
+    ):
+        """Runs function() once its turn comes, and returns its result."""
+        future = self.submit(
+            function,
+            priority=priority,
+            cancel_group=cancel_group,
+            operation=operation,
+            cost=cost,
+        )
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError as error:
+            raise RequestCancelled(f"Cancelled {cancel_group} request") from error
+
+    def cancel(self, cancel_group):
+        """Drops every queued request in 'cancel_group', returning how many."""
+        with self.condition:
+            kept = []
+            dropped = []
+            for entry in self.queue:
+                if entry[3] == cancel_group and cancel_group is not None:
+                    dropped.append(entry)
+                else:
+                    kept.append(entry)
+            heapq.heapify(kept)
+            self.queue = kept
+            for entry in dropped:
+                paid = self.paid.pop(entry[1], 0)
+                if paid:
+                    self.rate_limiter.refund(entry[4], paid)
+                entry[7].cancel()
+                self.cancelled[entry[0]] += 1
+            # Refunds may let waiting requests start.
+            self.condition.notify_all()
+        if dropped:
+            logging.info("Cancelled %s queued %s requests.", len(dropped), cancel_group)
+        return len(dropped)
+
+    def _pop_admitted(self):
+        """Pops the first request in priority order whose cost is paid, if any.
+
+        Returns the request, or None and how long until the budget refills
+        enough for another look. Tokens only go to the first waiting request
+        of each operation, which keeps the ones it has already collected.
+        """
+        blocked = set()
+        retry_after = None
+        for entry in sorted(self.queue):
+            sequence, operation, cost = entry[1], entry[4], entry[5]
+            if self.rate_limiter is not None and operation is not None and cost:
+                if operation in blocked:
+                    continue
+                paid = self.paid.pop(sequence, 0)
+                paid += self.rate_limiter.take_available(operation, cost - paid)
+                if paid < cost:
+                    self.paid[sequence] = paid
+                    blocked.add(operation)
+                    wait = self.rate_limiter.estimate_wait(operation)
+                    if retry_after is None or wait < retry_after:
+                        retry_after = wait
+                    continue
+            self.queue.remove(entry)
+            heapq.heapify(self.queue)
+            return entry, None
+        return None, retry_after
+
+    def _work(self):
+        while True:
+            with self.condition:
+                entry, retry_after = self._pop_admitted()
+                while entry is None:
+                    self.condition.wait(retry_after)
+                    entry, retry_after = self._pop_admitted()
+                priority, _, queued_at, _, operation, cost, function, future = entry
+                # Includes the time spent waiting on the rate budget.
+                wait = time.monotonic() - queued_at
+                self.waits[priority].append(wait)
+                depth = len(self.queue)
+            if not future.set_running_or_notify_cancel():
+                if self.rate_limiter is not None and operation is not None and cost:
+                    self.rate_limiter.refund(operation, cost)
+                continue
+            logging.debug(
+                "Starting %s request after %.2fs in queue, %s still queued.",
+                PRIORITY_NAMES.get(priority, priority),
+                wait,
+                depth,
+            )
+            try:
+                future.set_result(function())
+            except BaseException as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+
+    def stats(self):
+        """Returns queue depth and recent wait times per priority."""
+        with self.condition:
+            depths = collections.Counter(entry[0] for entry in self.queue)
+            stats = {}
+            for priority in sorted(set(depths) | set(self.waits) | set(self.cancelled)):
+                waits = sorted(self.waits[priority]) or [0]
+                stats[PRIORITY_NAMES.get(priority, priority)] = {
+                    "queued": depths[priority],
+                    "cancelled": self.cancelled[priority],
+                    "mean_wait_seconds": sum(waits) / len(waits),
+                    "p95_wait_seconds": waits[int(0.95 * (len(waits) - 1))],
+                    "max_wait_seconds": waits[-1],
+                }
+            return stats
+
+    def log_stats(self):
+        for priority, stats in self.stats().items():
+            logging.info(
+                "%s: %s queued, %s cancelled, mean wait %.2fs, p95 %.2fs, max %.2fs",
+                priority,
+                stats["queued"],
+                stats["cancelled"],
+                stats["mean_wait_seconds"],
+                stats["p95_wait_seconds"],
+                stats["max_wait_seconds"],
+            )
+
+
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def get_domain_from_url(url, granularity=REGISTRABLE_DOMAIN_GRANULARITY):
     """Return the domain of a URL.
 
+    Results are memoized, since the same URLs are parsed again every time
+    the item list is loaded or regrouped. A port other than the scheme's
+    default is kept in host mode, and in either mode for IP addresses and
+    single-label hosts, so localhost:3000 and localhost:8080 stay apart.
+
     Args:
         url (str): A string representing the URL.
+        granularity (str): HOST_GRANULARITY or REGISTRABLE_DOMAIN_GRANULARITY.
 
     Returns:
         str: The domain of the URL.
     """
-    parsed_url = urlparse(url)
-    domain = parsed_url.netloc
+    parsed_url = urlsplit(url)
+    domain = parsed_url.hostname or ""
+    is_local = "." not in domain or public_suffix.is_ip_address(domain)
+    if granularity == REGISTRABLE_DOMAIN_GRANULARITY and not is_local:
+        return sys.intern(public_suffix.get_registrable_domain(domain))
     if domain.startswith("www."):
         domain = domain[4:]
-    return domain
+    try:
+        port = parsed_url.port
+    except ValueError:
+        port = None
+    if domain and port and port != DEFAULT_PORTS.get(parsed_url.scheme.lower()):
+        if ":" in domain:
+            domain = f"[{domain}]"
+        domain = f"{domain}:{port}"
+    return sys.intern(domain)
+
+
+@functools.lru_cache(maxsize=DOMAIN_SET_CACHE_SIZE)
+def get_shared_domain_set(domains):
+    """Returns the first equal domain set seen, so items can share one copy.
+
+    Items that share a site usually have identical domain sets.
+    """
+    return domains
+
+
+def get_domains_from_urls(url_list, granularity=REGISTRABLE_DOMAIN_GRANULARITY):
+    domains = frozenset(
+        domain
+        for domain in (get_domain_from_url(url, granularity) for url in url_list)
+        if domain
+    )
+    return get_shared_domain_set(domains)
+
+
+def iter_json_array(chunks):
+    """Yields the elements of a JSON array as its text arrives in chunks.
+
+    Only the unparsed tail of the stream is buffered, so each element can be
+    handled, and dropped, before the rest of the array has been read.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    chunks = itertools.chain(chunks, [None])
+    for chunk in chunks:
+        if chunk is not None:
+            buffer = buffer[position:] + chunk
+            position = 0
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != "[":
+                    raise json.JSONDecodeError("Expecting '['", buffer, position)
+                started = True
+                position += 1
+            elif buffer[position] == "]":
+                # Read to the end, so the source can finish cleanly.
+                for rest in itertools.chain([buffer[position + 1 :]], chunks):
+                    if rest and rest.strip():
+                        raise json.JSONDecodeError("Extra data", rest, 0)
+                return
+            elif buffer[position] == ",":
+                position += 1
+            else:
+                try:
+                    element, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if chunk is None:
+                        raise
+                    # The element continues in the next chunk.
+                    break
+                if (
+                    chunk is not None
+                    and buffer[end - 1].isdigit()
+                    and NUMBER_TAIL.match(buffer, end)
+                ):
+                    # A number at the end of the buffer may continue, as in
+                    # "12" + "3" or "1.5e" + "3", once the next chunk arrives.
+                    break
+                position = end
+                yield element
+    raise json.JSONDecodeError("Unterminated array", buffer, position)
+
+
+def iter_json_documents(serialized_stream):
+    """Yields the raw text of each JSON document in a concatenated stream."""
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        position = WHITESPACE.match(serialized_stream, position).end()
+        if position == len(serialized_stream):
+            return
+        _, end = decoder.raw_decode(serialized_stream, position)
+        yield serialized_stream[position:end]
+        position = end
+
+
+class ItemStore:
+    """Single-file SQLite cache of listed items, item details and scores.
+
+    One connection is shared between threads, so every statement runs under
+    a lock and every write runs in its own transaction.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            item_id TEXT PRIMARY KEY,
+            vault_id TEXT,
+            vault_name TEXT,
+            updated_at TEXT,
+            summary TEXT,
+            details TEXT,
+            details_updated_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS items_vault_id ON items (vault_id);
+        CREATE INDEX IF NOT EXISTS items_updated_at ON items (updated_at);
+        CREATE TABLE IF NOT EXISTS listings (
+            scope TEXT PRIMARY KEY,
+            listed_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS commands (
+            scope TEXT,
+            command TEXT,
+            output TEXT,
+            PRIMARY KEY (scope, command)
+        );
+        CREATE TABLE IF NOT EXISTS scores (
+            score_key TEXT PRIMARY KEY,
+            score NUMERIC
+        );
+        CREATE TABLE IF NOT EXISTS journal (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT,
+            item_id TEXT,
+            vault_id TEXT,
+            payload TEXT,
+            attempts INTEGER DEFAULT 0
+        );
+    """
+    LISTING_BATCH_SIZE = 500
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.temp_tables = itertools.count()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    @staticmethod
+    def _scope(vault):
+        return vault or ""
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def clear(self):
+        """Forgets every cached item, listing, command and score.
+
+        Journal entries are kept, since they're edits the user has made
+        that op hasn't applied yet. Like rewrite_details, freed pages are
+        zeroed and the write-ahead log truncated, so nothing cleared can be
+        read back from the files.
+        """
+        with self.lock:
+            self.connection.execute("PRAGMA secure_delete=ON")
+            with self.connection:
+                for table in ("items", "listings", "commands", "scores"):
+                    self.connection.execute(f"DELETE FROM {table}")
+            self.connection.execute("VACUUM")
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def has_listing(self, vault):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM listings WHERE scope = ?", (self._scope(vault),)
+            ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def _vault_filter(vault):
+        if vault:
+            return " AND (vault_id = ? OR vault_name = ?)", (vault, vault)
+        return "", ()
+
+    def load_items(self, vault):
+        """Returns (summary, details) JSON pairs for every listed item.
+
+        Details older than the listing are returned as None.
+        """
+        vault_filter, params = self._vault_filter(vault)
+        query = (
+            "SELECT summary, CASE WHEN details_updated_at = updated_at "
+            "THEN details END FROM items WHERE summary IS NOT NULL"
+            f"{vault_filter} ORDER BY rowid"
+        )
+        with self.lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def get_stale_item_ids(self, vault):
+        """Returns (item_id, vault_id) for cached details older than the listing."""
+        vault_filter, params = self._vault_filter(vault)
+        query = (
+            "SELECT item_id, vault_id FROM items WHERE details IS NOT NULL "
+            f"AND details_updated_at != updated_at{vault_filter}"
+        )
+        with self.lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def replace_listing(self, vault, raw_items):
+        """Stores the output of an item listing, forgetting unlisted items."""
+        collections.deque(self.iter_replace_listing(vault, raw_items), maxlen=0)
+
+    def iter_replace_listing(self, vault, raw_items):
+        """Stores an item listing while it streams in, a batch at a time.
+
+        Yields (raw_item, details) for each listed item, where details is the
+        cached details JSON if it's still current, or None. Unlisted items
+        are only forgotten once the whole listing has been consumed.
+        """
+        listed_table = f"listed_{next(self.temp_tables)}"
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"CREATE TEMP TABLE {listed_table} (item_id TEXT PRIMARY KEY)"
+            )
+        try:
+            batch = []
+            for raw_item in raw_items:
+                batch.append(raw_item)
+                if len(batch) >= self.LISTING_BATCH_SIZE:
+                    yield from self._store_listing_batch(listed_table, batch)
+                    batch = []
+            yield from self._store_listing_batch(listed_table, batch)
+
+            vault_filter, params = self._vault_filter(vault)
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "DELETE FROM items WHERE summary IS NOT NULL AND item_id NOT IN "
+                    f"(SELECT item_id FROM {listed_table}){vault_filter}",
+                    params,
+                )
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO listings VALUES (?, ?)",
+                    (self._scope(vault), time.time()),
+                )
+        finally:
+            with self.lock, self.connection:
+                self.connection.execute(f"DROP TABLE IF EXISTS {listed_table}")
+
+    def _store_listing_batch(self, listed_table, raw_items):
+        if not raw_items:
+            return []
+        rows = [
+            (
+                raw_item["id"],
+                raw_item["vault"]["id"],
+                raw_item["vault"]["name"],
+                raw_item["updated_at"],
+                json.dumps(raw_item),
+            )
+            for raw_item in raw_items
+        ]
+        listed_ids = [(row[0],) for row in rows]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR IGNORE INTO {listed_table} VALUES (?)", listed_ids
+            )
+            self.connection.executemany(
+                """
+                INSERT INTO items (item_id, vault_id, vault_name, updated_at, summary)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (item_id) DO UPDATE SET
+                    vault_id = excluded.vault_id,
+                    vault_name = excluded.vault_name,
+                    updated_at = excluded.updated_at,
+                    summary = excluded.summary
+                """,
+                rows,
+            )
+            placeholders = ", ".join("?" * len(listed_ids))
+            current_details = dict(
+                self.connection.execute(
+                    "SELECT item_id, details FROM items "
+                    f"WHERE item_id IN ({placeholders}) "
+                    "AND details_updated_at = updated_at",
+                    [row[0] for row in rows],
+                )
+            )
+        return [
+            (raw_item, current_details.get(raw_item["id"])) for raw_item in raw_items
+        ]
 
+    def get_details(self, item_id):
+        """Returns cached details JSON, unless the listing has seen a newer edit."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT details FROM items "
+                "WHERE item_id = ? AND details_updated_at = updated_at",
+                (item_id,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_details(self, item_details):
+        self.put_many_details([item_details])
+
+    def put_many_details(self, item_details_list):
+        rows = [
+            (
+                item_details.item_id,
+                item_details.vault_id,
+                item_details.fields["updated_at"],
+                item_details.serialized,
+                item_details.fields["updated_at"],
+            )
+            for item_details in item_details_list
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO items (item_id, vault_id, updated_at, details,
+                                   details_updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (item_id) DO UPDATE SET
+                    updated_at = excluded.updated_at,
+                    details = excluded.details,
+                    details_updated_at = excluded.details_updated_at
+                """,
+                rows,
+            )
 
-def get_domains_from_urls(url_list):
-    return {get_domain_from_url(url) for url in url_list if get_domain_from_url(url)}
+    def load_plaintext_details(self):
+        """Returns (item_id, details) for cached details that aren't digests."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT item_id, details FROM items WHERE details IS NOT NULL "
+                f"AND json_type(details, '$.{ItemDetails.DIGESTS_KEY}') IS NULL"
+            ).fetchall()
+
+    def forget_digest_details(self):
+        """Drops cached details that are digests, returning how many there were."""
+        with self.lock, self.connection:
+            return self.connection.execute(
+                "UPDATE items SET details = NULL, details_updated_at = NULL "
+                f"WHERE json_type(details, '$.{ItemDetails.DIGESTS_KEY}') IS NOT NULL"
+            ).rowcount
+
+    def rewrite_details(self, rows):
+        """Overwrites cached details text from (item_id, details) pairs.
+
+        Unlike put_many_details this leaves freshness alone. Old pages are
+        zeroed and the file compacted, so the replaced text doesn't linger.
+        """
+        with self.lock:
+            self.connection.execute("PRAGMA secure_delete=ON")
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE items SET details = ? WHERE item_id = ?",
+                    [(details, item_id) for item_id, details in rows],
+                )
+            self.connection.execute("VACUUM")
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def delete_item(self, item_id):
+        self.delete_items([item_id])
+
+    def delete_items(self, item_ids):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM items WHERE item_id = ?", [(i,) for i in item_ids]
+            )
+
+    def get_command_output(self, vault, command):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT output FROM commands WHERE scope = ? AND command = ?",
+                (self._scope(vault), command),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_command_output(self, vault, command, output):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO commands VALUES (?, ?, ?)",
+                (self._scope(vault), command, output),
+            )
+
+    def load_scores(self):
+        with self.lock:
+            return dict(self.connection.execute("SELECT score_key, score FROM scores"))
+
+    def put_scores(self, scores):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?)", scores.items()
+            )
+
+    def append_journal_entry(self, action, item_id, vault_id, payload):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO journal (action, item_id, vault_id, payload) "
+                "VALUES (?, ?, ?, ?)",
+                (action, item_id, vault_id, json.dumps(payload)),
+            )
+        return cursor.lastrowid
+
+    def load_journal(self):
+        """Returns pending (entry_id, action, item_id, vault_id, payload) rows."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT entry_id, action, item_id, vault_id, payload "
+                "FROM journal ORDER BY entry_id"
+            ).fetchall()
+        return [row[:4] + (json.loads(row[4]),) for row in rows]
+
+    def record_journal_attempt(self, entry_id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE journal SET attempts = attempts + 1 WHERE entry_id = ?",
+                (entry_id,),
+            )
+            row = self.connection.execute(
+                "SELECT attempts FROM journal WHERE entry_id = ?", (entry_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def remove_journal_entry(self, entry_id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM journal WHERE entry_id = ?", (entry_id,)
+            )
+
+    def drop_journal_entries(self, entry_ids):
+        """Deletes journal entries so their payloads can't be read back.
+
+        Like clear, freed pages are zeroed and the write-ahead log truncated.
+        """
+        with self.lock:
+            self.connection.execute("PRAGMA secure_delete=ON")
+            with self.connection:
+                self.connection.executemany(
+                    "DELETE FROM journal WHERE entry_id = ?",
+                    [(entry_id,) for entry_id in entry_ids],
+                )
+            self.connection.execute("VACUUM")
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class ScoreCache:
+    """Persistent map of DuplicateSet score keys to difference scores."""
+
+    def __init__(self, item_store):
+        self.item_store = item_store
+        self.lock = threading.Lock()
+        self.scores = item_store.load_scores()
+        self.new_scores = {}
+
+    def get(self, score_key):
+        with self.lock:
+            return self.scores.get(score_key)
+
+    def put(self, score_key, score):
+        with self.lock:
+            self.scores[score_key] = score
+            self.new_scores[score_key] = score
+
+    def clear(self):
+        with self.lock:
+            self.scores = {}
+            self.new_scores = {}
+
+    def flush(self):
+        """Writes new scores to disk, if there are any."""
+        with self.lock:
+            if not self.new_scores:
+                return
+            self.item_store.put_scores(self.new_scores)
+            self.new_scores = {}
+
+
+class LoadProgress:
+    """Thread-safe counts of what a long load has done so far, for display.
+
+    The estimate of time remaining comes from the rate limiter, since
+    budgets rather than latency dominate large detail fetches.
+    """
+
+    def __init__(self, rate_limiter=None):
+        self.lock = threading.Lock()
+        self.rate_limiter = rate_limiter
+        self.phase = ""
+        self.items_listed = 0
+        self.details_expected = 0
+        self.details_fetched = 0
+        self.cache_hits = 0
+
+    def start_phase(self, phase):
+        with self.lock:
+            self.phase = phase
+
+    def record_listed(self, count):
+        with self.lock:
+            self.items_listed = count
+
+    def expect_details(self, count):
+        with self.lock:
+            self.details_expected += count
+
+    def record_fetched(self, count=1):
+        with self.lock:
+            self.details_fetched += count
+
+    def record_cache_hits(self, count=1):
+        with self.lock:
+            self.cache_hits += count
+
+    def eta_seconds(self):
+        """Estimates how long the details still expected will take to fetch."""
+        with self.lock:
+            remaining = max(0, self.details_expected - self.details_fetched)
+        if not remaining or self.rate_limiter is None:
+            return 0
+        return self.rate_limiter.estimate_wait(READ_OPERATION, remaining)
+
+    def describe(self):
+        """Summarizes progress as a few lines of text."""
+        eta = self.eta_seconds()
+        with self.lock:
+            lines = [
+                self.phase,
+                f"{self.items_listed} items listed",
+                f"{self.details_fetched} of {self.details_expected} details fetched,"
+                f" {self.cache_hits} from cache",
+            ]
+        if eta >= 1:
+            lines.append(f"About {int(eta)}s left")
+        return "\n".join(line for line in lines if line)
+
+
+class FieldDigest(str):
+    """A keyed fingerprint standing in for a field value that isn't cached."""
+
+
+class FieldDigester:
+    """Computes keyed digests of field values.
+
+    Equal values get equal digests, which is all diffing and scoring need,
+    without the values themselves being cached. The key lives next to the
+    cache, readable only by its owner, so anyone who can read both can still
+    test guesses against a digest. Short or common values, like PINs or
+    reused passwords, can then be recovered by brute force.
+    """
+
+    KEY_BYTES = 32
+
+    def __init__(self, key, is_new_key=False):
+        self.key = key
+        self.is_new_key = is_new_key
+
+    @classmethod
+    def from_key_file(cls, key_path):
+        """Loads the digest key, creating it on first use."""
+        try:
+            with open(key_path, "rb") as key_file:
+                return cls(key_file.read())
+        except FileNotFoundError:
+            pass
+        key = os.urandom(cls.KEY_BYTES)
+        descriptor = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, "wb") as key_file:
+            key_file.write(key)
+        return cls(key, is_new_key=True)
+
+    def digest(self, value):
+        mac = hmac.new(
+            self.key, json.dumps(value, sort_keys=True).encode(), hashlib.sha256
+        )
+        return FieldDigest(f"hmac-sha256:{mac.hexdigest()[:32]}")
+
+
+class FieldRecord(collections.abc.Mapping):
+    """Read-only mapping of an item's field names to values.
+
+    Values are kept in a tuple, and records with the same field names share
+    one interned name-to-position layout instead of each holding a dict.
+    """
+
+    __slots__ = ("layout", "values")
+
+    def __init__(self, fields):
+        self.layout = self.get_layout(tuple(fields))
+        self.values = tuple(fields.values())
+
+    @staticmethod
+    @functools.lru_cache(maxsize=FIELD_LAYOUT_CACHE_SIZE)
+    def get_layout(names):
+        """Returns the shared name-to-position map for these field names."""
+        return {sys.intern(name): i for i, name in enumerate(names)}
+
+    def __getitem__(self, field_name):
+        return self.values[self.layout[field_name]]
+
+    def __iter__(self):
+        return iter(self.layout)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return repr(dict(self))
 
 
 class ItemList:
@@ -69,26 +1325,74 @@ class ItemList:
     def __getitem__(self, i):
         return self.items[i]
 
+    def __len__(self):
+        return len(self.items)
+
+    def replace(self, item_details):
+        for i, existing in enumerate(self.items):
+            if existing.item_id == item_details.item_id:
+                self.items[i] = item_details
+                return
+        self.items.append(item_details)
+
+    def remove(self, item_id):
+        self.remove_all([item_id])
+
+    def remove_all(self, item_ids):
+        item_ids = set(item_ids)
+        self.items = [item for item in self.items if item.item_id not in item_ids]
+
     @classmethod
     def from_json(cls, serialized_json, op_api=None):
-        raw_items = json.loads(serialized_json)
+        return cls(list(cls.iter_from_stream([serialized_json], op_api)), op_api=op_api)
+
+    @staticmethod
+    def iter_from_stream(chunks, op_api=None):
+        """Yields list skeletons for an 'op item list' output arriving in chunks."""
+        for raw_item in iter_json_array(chunks):
+            yield ItemDetails.from_list(raw_item, op_api=op_api)
+
+    @classmethod
+    def from_store(cls, rows, op_api=None):
+        """Builds the list from ItemStore rows, using cached details if present."""
         item_details_list = []
-        for raw_item in raw_items:
-            item_details_list.append(ItemDetails.from_list(raw_item, op_api=op_api))
+        for summary, details in rows:
+            if details is not None:
+                item = ItemDetails.from_json(details, op_api=op_api)
+            else:
+                item = ItemDetails.from_list(json.loads(summary), op_api=op_api)
+            item_details_list.append(item)
         return cls(item_details_list, op_api=op_api)
 
 
 class ItemDetails:
-    """A single 1Password item."""
+    """A single 1Password item.
+
+    The JSON it was built from is only kept when asked for, since it's
+    needed just for edit templates and is several times the size of the
+    parsed fields.
+    """
+
+    __slots__ = (
+        "item_id",
+        "serialized",
+        "source",
+        "fields",
+        "domains",
+        "op_api",
+        "vault_id",
+    )
 
     SERIALIZED_SOURCE = "serialized"
     JSON_SOURCE = "json"
     JSON_LIST_SOURCE = "list_skeleton"
+    DIGEST_SOURCE = "digest"
+    DIGESTS_KEY = "field_digests"
 
     def __init__(
         self,
         item_id,
-        fields=(),
+        fields=None,
         source=None,
         serialized=None,
         domains=frozenset([]),
@@ -98,6 +1402,8 @@ class ItemDetails:
         self.item_id = item_id
         self.serialized = serialized
         self.source = source
+        if not isinstance(fields, FieldRecord):
+            fields = FieldRecord(fields or {})
         self.fields = fields
         self.domains = domains
         self.op_api = op_api
@@ -116,6 +1422,9 @@ class ItemDetails:
         return self.domains and self.domains != frozenset([""])
 
     def has_full_details(self):
+        return self.source in (ItemDetails.JSON_SOURCE, ItemDetails.DIGEST_SOURCE)
+
+    def has_plaintext(self):
         return ItemDetails.JSON_SOURCE == self.source
 
     def get_app_deeplink(self):
@@ -129,55 +1438,229 @@ class ItemDetails:
     def get_deeplink(self):
         return self.op_api.get_item_deeplink(self.item_id)
 
-    @classmethod
-    def from_json(cls, serialized_json, op_api=None):
-        details = json.loads(serialized_json)
-        item_id = details["id"]
-        fields = {
+    @staticmethod
+    def get_summary_fields(details):
+        """Returns the fields that item listings include, from op's JSON."""
+        return {
             "title": details.get("title", "Untitled"),
             "tags": details.get("tags", []),
             "urls": [i["href"] for i in details.get("urls", [])],
-            "vault": details["vault"]["name"],
-            "category": details["category"],
+            "vault": sys.intern(details["vault"]["name"]),
+            "category": sys.intern(details["category"]),
             "updated_at": details["updated_at"],
+            "additional_information": details.get("additional_information", ""),
         }
-        for field in details["fields"]:
-            if field.get("value"):
-                if field.get("label"):
-                    fields[field["label"]] = field["value"]
-                else:
-                    fields[field["id"]] = field["value"]
+
+    @staticmethod
+    def get_domains(urls, op_api=None):
+        """Returns the domains of urls at the op_api's grouping granularity."""
+        granularity = getattr(
+            op_api, "domain_granularity", REGISTRABLE_DOMAIN_GRANULARITY
+        )
+        return get_domains_from_urls(urls, granularity)
+
+    @classmethod
+    def from_json(cls, serialized_json, op_api=None, retain_serialized=False):
+        """Builds an item from op's details JSON, or from a compact digest."""
+        details = json.loads(serialized_json)
+        item_id = details["id"]
+        fields = cls.get_summary_fields(details)
+        if cls.DIGESTS_KEY in details:
+            source = cls.DIGEST_SOURCE
+            for field_name, digest in details[cls.DIGESTS_KEY].items():
+                fields[field_name] = FieldDigest(digest)
+        else:
+            source = cls.JSON_SOURCE
+            for field in details["fields"]:
+                if field.get("value"):
+                    if field.get("label"):
+                        fields[field["label"]] = field["value"]
+                    else:
+                        fields[field["id"]] = field["value"]
+            if "additional_information" not in details:
+                # What op lists for logins, for details that leave it out.
+                fields["additional_information"] = fields.get("username", "")
         return cls(
             item_id,
             fields=fields,
-            source=cls.JSON_SOURCE,
-            serialized=serialized_json,
-            domains=get_domains_from_urls(fields["urls"]),
+            source=source,
+            serialized=serialized_json if retain_serialized else None,
+            domains=cls.get_domains(fields["urls"], op_api),
             op_api=op_api,
             vault_id=details["vault"]["id"],
         )
 
+    def to_digests(self, digester):
+        """Returns a compact copy that keeps only digests of non-listing fields."""
+        digests = {
+            field_name: digester.digest(value)
+            for field_name, value in self.fields.items()
+            if field_name not in DISPLAY_SAFE_FIELDS
+        }
+        compact = {
+            "id": self.item_id,
+            "title": self.fields["title"],
+            "tags": self.fields["tags"],
+            "urls": [{"href": url} for url in self.fields["urls"]],
+            "vault": {"id": self.vault_id, "name": self.fields["vault"]},
+            "category": self.fields["category"],
+            "updated_at": self.fields["updated_at"],
+            "additional_information": self.fields.get("additional_information", ""),
+            self.DIGESTS_KEY: digests,
+        }
+        fields = {
+            field_name: value
+            for field_name, value in self.fields.items()
+            if field_name in DISPLAY_SAFE_FIELDS
+        }
+        fields.update(digests)
+        return ItemDetails(
+            self.item_id,
+            fields=fields,
+            source=self.DIGEST_SOURCE,
+            serialized=json.dumps(compact),
+            domains=self.domains,
+            op_api=self.op_api,
+            vault_id=self.vault_id,
+        )
+
+    def with_updates(self, fields):
+        """Returns a local copy of this item as it will look after an edit."""
+        new_fields = dict(self.fields)
+        for field_name, values in fields.items():
+            if field_name in UNIMPLEMENTED_FIELDS:
+                continue
+            if field_name == "tags":
+                new_fields["tags"] = get_merged_tags(self, values)
+            elif values == "" and field_name not in ("urls", "title"):
+                new_fields.pop(field_name, None)
+            else:
+                new_fields[field_name] = values
+        # op will bump updated_at too. Bumping it here keeps scores of the
+        # local copy from being cached under the unedited item's revision.
+        new_fields["updated_at"] = (
+            datetime.datetime.now(datetime.timezone.utc)
+            .isoformat(timespec="microseconds")
+            .replace("+00:00", "Z")
+        )
+        digester = getattr(self.op_api, "digester", None)
+        if self.source == self.DIGEST_SOURCE and digester is not None:
+            new_fields = {
+                field_name: value
+                if field_name in DISPLAY_SAFE_FIELDS or isinstance(value, FieldDigest)
+                else digester.digest(value)
+                for field_name, value in new_fields.items()
+            }
+        return ItemDetails(
+            self.item_id,
+            fields=new_fields,
+            source=self.source,
+            serialized=self.serialized,
+            domains=self.get_domains(new_fields.get("urls") or [], self.op_api),
+            op_api=self.op_api,
+            vault_id=self.vault_id,
+        )
+
     @classmethod
     def from_list(cls, details, op_api=None):
         item_id = details["id"]
-        fields = {
-            "title": details.get("title", "Untitled"),
-            "tags": details.get("tags", []),
-            "urls": [i["href"] for i in details.get("urls", [])],
-            "vault": details["vault"]["name"],
-            "category": details["category"],
-            "updated_at": details["updated_at"],
-        }
+        fields = cls.get_summary_fields(details)
         return cls(
             item_id,
             fields=fields,
             source=cls.JSON_LIST_SOURCE,
-            domains=get_domains_from_urls(fields["urls"]),
+            domains=cls.get_domains(fields["urls"], op_api),
             op_api=op_api,
             vault_id=details["vault"]["id"],
         )
 
 
+def needs_edit_template(fields):
+    """Whether 'fields' can only be applied by sending a full item template.
+
+    Assignment statements and --url can only set an item's primary URL, so
+    copying a list of several URLs goes through a JSON template instead.
+    """
+    return len(fields.get("urls") or []) > 1
+
+
+def get_merged_tags(item_details, tags):
+    existing_tags = item_details.fields["tags"]
+    return existing_tags + [tag for tag in tags if tag not in existing_tags]
+
+
+def get_edit_template(item_details, fields):
+    """Returns the item's details JSON with 'fields' applied to it."""
+    details = json.loads(item_details.serialized)
+    remaining = dict(fields)
+    if "title" in remaining:
+        details["title"] = remaining.pop("title")
+    if "urls" in remaining:
+        urls = remaining.pop("urls")
+        details["urls"] = [
+            {"href": url, "primary": i == 0} for i, url in enumerate(urls)
+        ]
+    if "tags" in remaining:
+        details["tags"] = get_merged_tags(item_details, remaining.pop("tags"))
+    template_fields = []
+    for field in details["fields"]:
+        field_name = field.get("label") or field["id"]
+        if field_name in remaining:
+            value = remaining.pop(field_name)
+            if value == "":
+                continue
+            field["value"] = value
+        template_fields.append(field)
+    for field_name, value in remaining.items():
+        if value != "":
+            template_fields.append(
+                {
+                    "id": field_name,
+                    "label": field_name,
+                    "type": "STRING",
+                    "value": value,
+                }
+            )
+    details["fields"] = template_fields
+    return json.dumps(details)
+
+
+def get_update_command(item_details, fields):
+    """Builds one op edit that applies every field in 'fields' to an item.
+
+    Returns the command and the text to send on its stdin, if any. The
+    command asks op to print the edited item, so no refetch is needed.
+    """
+    for field_name in UNIMPLEMENTED_FIELDS.intersection(fields):
+        logging.warning("Copying %s is currently unimplemented. Sorry.", field_name)
+    for field_name, values in fields.items():
+        if isinstance(values, FieldDigest):
+            raise OpApiError(f"Refusing to write a digest into {field_name}")
+    fields = {
+        field_name: values
+        for field_name, values in fields.items()
+        if field_name not in UNIMPLEMENTED_FIELDS
+    }
+    command = ["item", "edit", item_details.item_id, "--format=json"]
+    if needs_edit_template(fields):
+        # Sent through stdin so the template's secrets never touch the disk.
+        command.append("--template=/dev/stdin")
+        return command, get_edit_template(item_details, fields)
+
+    for field_name, values in fields.items():
+        if field_name == "urls":
+            command += ["--url", values[0] if values else ""]
+        elif field_name == "tags":
+            command += ["--tags", ",".join(get_merged_tags(item_details, values))]
+        elif field_name == "title":
+            command += ["--title", values]
+        elif values == "":
+            command.append(f"{field_name}[delete]")
+        else:
+            command.append(f"{field_name}={values}")
+    return command, None
+
+
 class OpApi:
     """Connection Manager for the 1Password API.
 
@@ -190,79 +1673,597 @@ class OpApi:
                      with large numbers of items.
     """
 
-    def __init__(self, cache_dir="./.op-cache", vault=None, call_interval_seconds=0.21):
+    MAX_ATTEMPTS = 6
+    BACKOFF_BASE_SECONDS = 1
+    BACKOFF_MAX_SECONDS = 60
+    LIST_TIMEOUT_SECONDS = 300
+    LISTING_PROGRESS_INTERVAL = 500
+    BULK_BATCH_SIZE = 100
+
+    def __init__(
+        self,
+        cache_dir="./.op-cache",
+        vault=None,
+        rate_budgets=None,
+        sync=False,
+        max_in_flight=8,
+        progress=None,
+        compact_cache=False,
+        domain_granularity=REGISTRABLE_DOMAIN_GRANULARITY,
+        near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD,
+        op_path="op",
+    ):
         self.vault = vault
         self.cache_dir = cache_dir
+        self.compact_cache = compact_cache
+        self.domain_granularity = domain_granularity
+        self.near_matcher = None
+        if near_duplicate_threshold:
+            self.near_matcher = NearDuplicateMatcher(near_duplicate_threshold)
         if not os.path.exists(self.cache_dir):
             os.mkdir(self.cache_dir)
-        self.api_rate_limiter = RateLimiter(call_interval_seconds)
-        self.items = self.get_item_list()
-        self.item_ids = [item.item_id for item in self.items]
+        self.api_rate_limiter = RateLimiter(rate_budgets)
+        self.progress = progress or LoadProgress()
+        self.progress.rate_limiter = self.api_rate_limiter
+        self.retry_policy = RetryPolicy(
+            self.api_rate_limiter,
+            max_attempts=self.MAX_ATTEMPTS,
+            backoff_base_seconds=self.BACKOFF_BASE_SECONDS,
+            backoff_max_seconds=self.BACKOFF_MAX_SECONDS,
+        )
+        self.executor = CommandExecutor(op_path=op_path, max_in_flight=max_in_flight)
+        self.scheduler = CommandScheduler(
+            workers=max_in_flight, rate_limiter=self.api_rate_limiter
+        )
+        # Guards items, item_ids and archived_ids, which the UI thread and
+        # the mutation journal's worker both change.
+        self.items_lock = threading.RLock()
+        self.archived_ids = set()
+        self._open_cache()
+        self.duplicate_index = None
+        if sync:
+            self.sync_items()
+        else:
+            self._set_items(self.get_item_list())
+
+    def _open_cache(self):
+        self.item_store = ItemStore(f"{self.cache_dir}/op-cache.sqlite3")
+        self.score_cache = ScoreCache(self.item_store)
+        self.digester = None
+        if self.compact_cache:
+            self.digester = FieldDigester.from_key_file(f"{self.cache_dir}/digest.key")
+            if self.digester.is_new_key:
+                # Digests made with a lost key never match new ones.
+                forgotten = self.item_store.forget_digest_details()
+                if forgotten:
+                    logging.warning(
+                        "Digest key was missing; forgot %s cached items.", forgotten
+                    )
+            self._compact_stored_details()
 
-    def _get_command_cache_file_name(self, command):
-        return f"{self.cache_dir}/{self.vault}.{command}.cache"
+    def _compact_stored_details(self):
+        """Replaces details cached before compact mode was turned on."""
+        rows = self.item_store.load_plaintext_details()
+        if not rows:
+            return
+        logging.info("Compacting %s cached items.", len(rows))
+        self.item_store.rewrite_details(
+            [
+                (
+                    item_id,
+                    ItemDetails.from_json(details).to_digests(self.digester).serialized,
+                )
+                for item_id, details in rows
+            ]
+        )
+
+    def _store_details(self, item_details_list):
+        """Caches fetched details, then lets go of their JSON."""
+        self.item_store.put_many_details(item_details_list)
+        for item_details in item_details_list:
+            item_details.serialized = None
+
+    def compact_details(self, item_details):
+        """Returns what should be kept of freshly fetched details."""
+        if self.digester is None or not item_details.has_plaintext():
+            return item_details
+        return item_details.to_digests(self.digester)
 
     def clear_entire_cache(self):
+        """Empties the cache in place.
+
+        The store stays open, since the mutation journal and background
+        fetches may be using it, and pending journal entries survive. The
+        digest key is kept too, so compact items already in memory still
+        match ones fetched afterwards.
+        """
         logging.info("Clearing cache...")
-        shutil.rmtree(self.cache_dir)
-        os.mkdir(self.cache_dir)
+        self.item_store.clear()
+        self.score_cache.clear()
+        # Left behind by the per-command cache the ItemStore replaced.
+        for legacy_path in glob.glob(os.path.join(self.cache_dir, "*.cache")):
+            os.remove(legacy_path)
         logging.info("Cache cleared.")
 
     def clear_details_cache(self, item_id):
         self.get_item_details(item_id, force_refresh=True)
 
-    def run_command(self, command, skip_cache=False, cacheable=True, vault_id=None):
-        cache_file = self._get_command_cache_file_name(command)
+    def run_command(
+        self,
+        args,
+        skip_cache=False,
+        cacheable=True,
+        vault_id=None,
+        timeout_seconds=None,
+        input_text=None,
+        cost=1,
+        priority=INTERACTIVE_PRIORITY,
+        cancel_group=None,
+    ):
+        """Runs an op command through the scheduler, serving it from cache if allowed.
+
+        Background requests wait behind interactive ones, and while queued can
+        be dropped with scheduler.cancel(cancel_group).
+        """
+        command = " ".join(args)
         if cacheable and not skip_cache:
-            if os.path.exists(cache_file):
-                logging.debug("Pulling from cache: %s", cache_file)
-                with open(cache_file, "rb") as cache:
-                    return pickle.load(cache)
-
-        op_command = f"op {command}"
-        if not skip_cache:
-            op_command += " --cache"
-        if vault_id:
-            op_command += f" --vault {vault_id}"
-        elif self.vault:
-            op_command += f" --vault {self.vault}"
-        logging.info("Calling API: %s", op_command)
-        next(self.api_rate_limiter)
-        output = os.popen(op_command).read()
+            output = self.item_store.get_command_output(self.vault, command)
+            if output is not None:
+                logging.debug("Pulling from cache: %s", command)
+                return output
+
+        op_args = build_op_args(args, skip_cache, vault_id, self.vault)
+        output = self._run_with_retries(
+            op_args,
+            get_operation_class(args),
+            timeout_seconds=timeout_seconds,
+            input_text=input_text,
+            cost=cost,
+            priority=priority,
+            cancel_group=cancel_group,
+        )
         if output and cacheable:
-            with open(cache_file, "wb") as cache:
-                pickle.dump(output, cache)
+            self.item_store.put_command_output(self.vault, command, output)
         return output
 
+    def _run_with_retries(
+        self,
+        op_args,
+        operation,
+        timeout_seconds=None,
+        input_text=None,
+        cost=1,
+        priority=INTERACTIVE_PRIORITY,
+        cancel_group=None,
+    ):
+        """Runs an op command, backing off and retrying on recoverable errors.
+
+        'cost' is the number of API requests the command makes, which is more
+        than one when op reads a batch of items from stdin. Each attempt is
+        queued anew, so backoff happens here rather than on a worker, and a
+        retry waits behind anything more urgent that arrived meanwhile.
+        """
+        for attempt in itertools.count():
+            result = self.scheduler.run(
+                functools.partial(
+                    self._call_op,
+                    op_args,
+                    operation,
+                    timeout_seconds=timeout_seconds,
+                    input_text=input_text,
+                ),
+                priority=priority,
+                cancel_group=cancel_group,
+                operation=operation,
+                cost=cost,
+            )
+            if result.returncode == 0:
+                self.retry_policy.record_success(operation)
+                return result.stdout
+            backoff = self.retry_policy.get_backoff(attempt, operation, result.stderr)
+            if backoff is None:
+                raise OpCommandError(
+                    " ".join(["op"] + op_args), result.returncode, result.stderr
+                )
+            time.sleep(backoff)
+
+    def _call_op(self, op_args, operation, timeout_seconds=None, input_text=None):
+        logging.info("Calling API: op %s", " ".join(op_args))
+        return self.executor.run(
+            op_args,
+            operation=operation,
+            timeout_seconds=timeout_seconds,
+            input_text=input_text,
+        )
+
+    def stream_command(
+        self,
+        args,
+        skip_cache=False,
+        vault_id=None,
+        timeout_seconds=None,
+        priority=INTERACTIVE_PRIORITY,
+    ):
+        """Runs an uncacheable op command, yielding its output as it arrives.
+
+        Failures are retried like run_command's, but only while no output has
+        been yielded, since the caller may already have acted on it.
+        """
+        op_args = build_op_args(args, skip_cache, vault_id, self.vault)
+        operation = get_operation_class(args)
+        for attempt in itertools.count():
+            # Only waits for a worker and the rate budget; streaming happens
+            # on this thread so the caller sees output as it arrives.
+            self.scheduler.run(
+                lambda: None, priority=priority, operation=operation, cost=1
+            )
+            logging.info("Calling API: op %s", " ".join(op_args))
+            streamed = False
+            try:
+                for chunk in self.executor.stream(
+                    op_args, operation=operation, timeout_seconds=timeout_seconds
+                ):
+                    streamed = streamed or bool(chunk)
+                    yield chunk
+            except OpCommandError as error:
+                if streamed:
+                    raise
+                backoff = self.retry_policy.get_backoff(
+                    attempt, operation, error.stderr
+                )
+                if backoff is None:
+                    raise
+                time.sleep(backoff)
+            else:
+                self.retry_policy.record_success(operation)
+                return
+
     def refresh_item_ids(self):
-        self.items = self.get_item_list(force_refresh=True)
-        self.item_ids = [item.item_id for item in self.items]
+        self._set_items(self.get_item_list(force_refresh=True))
+
+    def _set_items(self, items):
+        with self.items_lock:
+            self.items = items
+            self.item_ids = [item.item_id for item in items]
+
+    def sync_items(self):
+        """Re-lists the account and re-fetches only the cached details that changed.
+
+        Details that were never cached stay lazy, so a warm start costs one
+        list call plus one get per edited item.
+        """
+        self.get_item_list(force_refresh=True)
+        stale_items = self.item_store.get_stale_item_ids(self.vault)
+        logging.info("Re-fetching %s items changed since last sync.", len(stale_items))
+        self.progress.start_phase("Re-fetching changed items")
+        self.progress.expect_details(len(stale_items))
+        for item_id, vault_id in stale_items:
+            self._fetch_item_details(item_id, force_refresh=True, vault_id=vault_id)
+        self._set_items(self.get_item_list())
+
+    def get_listed_item(self, item_id):
+        """Returns the item with item_id from the item list, or None."""
+        with self.items_lock:
+            return next((i for i in self.items if i.item_id == item_id), None)
+
+    def apply_item_update(self, item_details):
+        """Folds a freshly fetched item into the item list and duplicate index.
+
+        Items archived in this session are ignored, so an edit that finishes
+        after its item was archived can't bring it back.
+        """
+        with self.items_lock:
+            if item_details.item_id in self.archived_ids:
+                return
+            self.items.replace(item_details)
+            if item_details.item_id not in self.item_ids:
+                self.item_ids.append(item_details.item_id)
+            if self.duplicate_index is not None:
+                self.duplicate_index.update_item(item_details)
+
+    def apply_item_removal(self, item_id):
+        """Drops an archived item from the item list and duplicate index."""
+        self.apply_item_removals([item_id])
+
+    def forget_item_removal(self, item_id):
+        """Lets updates for an item whose archive was abandoned apply again."""
+        with self.items_lock:
+            self.archived_ids.discard(item_id)
+
+    def apply_item_removals(self, item_ids):
+        """Drops archived items from the item list and duplicate index."""
+        with self.items_lock:
+            self.archived_ids.update(item_ids)
+            self.items.remove_all(item_ids)
+            removed = set(item_ids)
+            self.item_ids = [i for i in self.item_ids if i not in removed]
+            if self.duplicate_index is not None:
+                for item_id in item_ids:
+                    self.duplicate_index.remove_item(item_id)
 
     def get_item_list(self, force_refresh=False):
-        output = self.run_command("item list --format=json", skip_cache=force_refresh)
-        item_list = ItemList.from_json(output, op_api=self)
-        return item_list
+        """Returns the account's items, listing them again if needed.
+
+        A fresh listing also rebuilds the duplicate index as it arrives;
+        otherwise the index is reset to be rebuilt from the cached list.
+        """
+        if force_refresh or not self.item_store.has_listing(self.vault):
+            return self._stream_item_list(skip_cache=force_refresh)
+        logging.debug("Loading item list from %s", self.item_store.db_path)
+        items = ItemList.from_store(self.item_store.load_items(self.vault), op_api=self)
+        self.progress.record_listed(len(items))
+        self.duplicate_index = None
+        return items
+
+    def _stream_item_list(self, skip_cache=False):
+        """Lists items from op, caching and indexing each one as it's parsed.
+
+        Items whose cached details are still current are indexed with them;
+        the rest start out as list skeletons.
+        """
+        self.progress.start_phase("Listing items")
+        chunks = self.stream_command(
+            ["item", "list", "--format=json"],
+            skip_cache=skip_cache,
+            timeout_seconds=self.LIST_TIMEOUT_SECONDS,
+        )
+        listing = self.item_store.iter_replace_listing(
+            self.vault, iter_json_array(chunks)
+        )
+        items = []
+
+        def iter_listed_items():
+            for raw_item, details in listing:
+                if details is None:
+                    item = ItemDetails.from_list(raw_item, op_api=self)
+                else:
+                    item = ItemDetails.from_json(details, op_api=self)
+                items.append(item)
+                if len(items) % self.LISTING_PROGRESS_INTERVAL == 0:
+                    self.progress.record_listed(len(items))
+                yield item
+
+        self.duplicate_index = DuplicateIndex(
+            iter_listed_items(), op_api=self, near_matcher=self.near_matcher
+        )
+        self.progress.record_listed(len(items))
+        return ItemList(items, op_api=self)
 
     def get_item_details(self, item_id, force_refresh=False, vault_id=None):
+        if not force_refresh:
+            details = self.item_store.get_details(item_id)
+            if details is not None:
+                self.progress.record_cache_hits()
+                return ItemDetails.from_json(details, op_api=self)
+        self.progress.expect_details(1)
+        item = self._fetch_item_details(
+            item_id, force_refresh=force_refresh, vault_id=vault_id
+        )
+        if force_refresh:
+            self.apply_item_update(item)
+        return item
+
+    def _fetch_item_details(
+        self,
+        item_id,
+        force_refresh=False,
+        vault_id=None,
+        priority=INTERACTIVE_PRIORITY,
+        cancel_group=None,
+    ):
+        item = self.compact_details(
+            self._get_plaintext_item(
+                item_id,
+                force_refresh=force_refresh,
+                vault_id=vault_id,
+                priority=priority,
+                cancel_group=cancel_group,
+            )
+        )
+        self._store_details([item])
+        self.progress.record_fetched()
+        return item
+
+    def _get_plaintext_item(
+        self,
+        item_id,
+        force_refresh=False,
+        vault_id=None,
+        priority=INTERACTIVE_PRIORITY,
+        cancel_group=None,
+    ):
+        """Fetches one item's details from op without caching them."""
         output = self.run_command(
-            f"item get {item_id} --format=json",
+            ["item", "get", item_id, "--format=json"],
             skip_cache=force_refresh,
+            cacheable=False,
             vault_id=vault_id,
+            priority=priority,
+            cancel_group=cancel_group,
         )
         try:
-            item = ItemDetails.from_json(output, op_api=self)
-        except json.decoder.JSONDecodeError:
+            return ItemDetails.from_json(output, op_api=self, retain_serialized=True)
+        except json.decoder.JSONDecodeError as error:
             logging.error("Error while attempting to read: %s", item_id)
-            sys.exit(1)
-        return item
+            raise OpApiError(f"Unreadable details for item {item_id}") from error
+
+    def get_items_details(
+        self,
+        items,
+        force_refresh=False,
+        priority=INTERACTIVE_PRIORITY,
+        cancel_group=None,
+    ):
+        """Returns full details for many items, fetching misses in bulk.
+
+        op reads the item references for each batch from stdin and streams
+        back one JSON document per item, so process start-up and auth are
+        paid once per batch instead of once per item.
+        """
+        details_by_id = {}
+        to_fetch = []
+        for item in items:
+            if item.has_full_details() and not force_refresh:
+                details_by_id[item.item_id] = item
+                continue
+            details = None
+            if not force_refresh:
+                details = self.item_store.get_details(item.item_id)
+            if details is None:
+                to_fetch.append(item)
+            else:
+                self.progress.record_cache_hits()
+                details_by_id[item.item_id] = ItemDetails.from_json(
+                    details, op_api=self
+                )
+        if to_fetch:
+            self.progress.start_phase("Fetching details")
+            self.progress.expect_details(len(to_fetch))
+
+        batches = [
+            to_fetch[i : i + self.BULK_BATCH_SIZE]
+            for i in range(0, len(to_fetch), self.BULK_BATCH_SIZE)
+        ]
+        cancelled = threading.Event()
+
+        def fetch(batch):
+            # Batches the pool hasn't started yet shouldn't queue up again
+            # after the rest of their group was cancelled.
+            if cancelled.is_set():
+                raise RequestCancelled(f"Cancelled {cancel_group} request")
+            return self._fetch_items_details(
+                batch, priority=priority, cancel_group=cancel_group
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.executor.max_in_flight
+        ) as executor:
+            try:
+                for fetched in executor.map(fetch, batches):
+                    details_by_id.update((item.item_id, item) for item in fetched)
+            except RequestCancelled:
+                cancelled.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.scheduler.cancel(cancel_group)
+                raise
+
+        for item in to_fetch:
+            if item.item_id not in details_by_id:
+                logging.warning("Bulk fetch skipped %s, fetching alone.", item.item_id)
+                details_by_id[item.item_id] = self._fetch_item_details(
+                    item.item_id,
+                    force_refresh=force_refresh,
+                    vault_id=item.vault_id,
+                    priority=priority,
+                    cancel_group=cancel_group,
+                )
+        if force_refresh:
+            for item in to_fetch:
+                self.apply_item_update(details_by_id[item.item_id])
+        return [details_by_id[item.item_id] for item in items]
+
+    def _fetch_items_details(
+        self, items, priority=INTERACTIVE_PRIORITY, cancel_group=None
+    ):
+        fetched = [
+            self.compact_details(item)
+            for item in self._get_plaintext_items(
+                items, priority=priority, cancel_group=cancel_group
+            )
+        ]
+        self._store_details(fetched)
+        self.progress.record_fetched(len(fetched))
+        return fetched
+
+    def _get_plaintext_items(
+        self, items, priority=INTERACTIVE_PRIORITY, cancel_group=None
+    ):
+        """Fetches many items' details in one op call without caching them."""
+        references = [
+            {"id": item.item_id, "vault": {"id": item.vault_id}} for item in items
+        ]
+        try:
+            output = self.run_command(
+                ["item", "get", "-", "--format=json"],
+                skip_cache=True,
+                cacheable=False,
+                timeout_seconds=self.LIST_TIMEOUT_SECONDS,
+                input_text=json.dumps(references),
+                cost=len(items),
+                priority=priority,
+                cancel_group=cancel_group,
+            )
+        except OpCommandError as error:
+            logging.warning("Bulk fetch of %s items failed: %s", len(items), error)
+            return []
+        return [
+            ItemDetails.from_json(document, op_api=self, retain_serialized=True)
+            for document in iter_json_documents(output)
+        ]
+
+    def get_plaintext_details(self, items, retain_serialized=False):
+        """Returns the items with their real field values, for display or edits.
+
+        Items cached only as digests are fetched again, and what's fetched
+        here is never written to the cache. retain_serialized also reloads
+        items that no longer hold op's JSON, as edit templates need it.
+        """
+        fetched = {}
+        to_fetch = []
+        for item in items:
+            if item.has_plaintext() and (item.serialized or not retain_serialized):
+                continue
+            details = self.item_store.get_details(item.item_id)
+            cached = details and ItemDetails.from_json(
+                details, op_api=self, retain_serialized=True
+            )
+            if cached and cached.has_plaintext():
+                fetched[item.item_id] = cached
+            else:
+                to_fetch.append(item)
+        if to_fetch:
+            fetched.update(
+                (item.item_id, item) for item in self._get_plaintext_items(to_fetch)
+            )
+        for item in to_fetch:
+            if item.item_id not in fetched:
+                fetched[item.item_id] = self._get_plaintext_item(
+                    item.item_id, vault_id=item.vault_id
+                )
+        return [fetched.get(item.item_id, item) for item in items]
+
+    def hydrate_duplicate_sets(
+        self, duplicate_sets, priority=INTERACTIVE_PRIORITY, cancel_group=None
+    ):
+        """Fetches full details for every member of every set in bulk."""
+        items = [
+            item
+            for duplicate_set in duplicate_sets
+            for item in duplicate_set.items
+            if not item.has_full_details()
+        ]
+        if not items:
+            return
+        logging.info("Hydrating %s items in bulk.", len(items))
+        details_by_id = {
+            item.item_id: item
+            for item in self.get_items_details(
+                items, priority=priority, cancel_group=cancel_group
+            )
+        }
+        for duplicate_set in duplicate_sets:
+            duplicate_set.items[:] = [
+                details_by_id.get(item.item_id, item) for item in duplicate_set.items
+            ]
 
     def get_item_deeplink(self, item_id):
-        return self.run_command(f"item get {item_id} --share-link")
+        return self.run_command(["item", "get", item_id, "--share-link"])
 
     def archive_item(self, item_id):
         logging.warning("Archiving item %s", item_id)
-        self.run_command(f"item delete {item_id} --archive", cacheable=False)
-        self.refresh_item_ids()
+        self.run_command(["item", "delete", item_id, "--archive"], cacheable=False)
+        self.item_store.delete_item(item_id)
+        self.apply_item_removal(item_id)
 
     def create_item(
         self,
@@ -271,48 +2272,41 @@ class OpApi:
         url="https://example.com",
         generate_password=True,
     ):
-        command = f'item create --template="{item_template_path}"'
+        command = ["item", "create", f"--template={item_template_path}"]
         if generate_password:
-            command += " --generate-password"
+            command.append("--generate-password")
         if title:
-            command += f' --title "{title}"'
+            command += ["--title", title]
         if url:
-            command += f' --url "{url}"'
+            command += ["--url", url]
         return self.run_command(command, cacheable=False, skip_cache=True)
 
     def add_tag(self, item_details, tag):
-        item_id = item_details.item_id
-        all_tags = item_details.fields["tags"] + [tag]
-        command = f'item edit {item_id} --tags "{all_tags[0]}"'
-        for other_tag in all_tags[1:]:
-            command += f',"{other_tag}"'
-        self.run_command(command, cacheable=False)
-        return self.get_item_details(item_id, force_refresh=True)
+        return self.update_item(item_details, {"tags": [tag]})
 
     def update_item(self, item_details, fields):
-        item_id = item_details.item_id
-        for field_name, values in fields.items():
-            if field_name == "urls":
-                logging.warning("Only copying over the first URL: %s", values[0])
-                command = f'item edit {item_id} --url "{values[0]}"'
-            elif field_name == "tags":
-                for value in values:
-                    item_details = self.add_tag(item_details, value)
-                continue
-            elif field_name in UNIMPLEMENTED_FIELDS:
-                logging.warning(
-                    "Copying %s is currently unimplemented. Sorry.", field_name
-                )
-                continue
-            elif values == "":
-                command = f"item edit {item_id} {field_name}[delete]"
-            else:
-                command = f'item edit {item_id} {field_name}="{values}"'
-            self.run_command(command, cacheable=False)
-        self.get_item_details(item_id, force_refresh=True)
-        self.refresh_item_ids()
+        """Applies all of 'fields' to an item in one edit and returns the result."""
+        if needs_edit_template(fields) and not (
+            item_details.has_plaintext() and item_details.serialized
+        ):
+            item_details = self.get_plaintext_details(
+                [item_details], retain_serialized=True
+            )[0]
+        command, input_text = get_update_command(item_details, fields)
+        output = self.run_command(command, cacheable=False, input_text=input_text)
+        try:
+            item = self.compact_details(
+                ItemDetails.from_json(output, op_api=self, retain_serialized=True)
+            )
+        except (json.decoder.JSONDecodeError, KeyError):
+            logging.warning("Unreadable edit output, re-fetching %s.", command[2])
+            return self.get_item_details(item_details.item_id, force_refresh=True)
+        self._store_details([item])
+        self.apply_item_update(item)
+        return item
 
-    def copy_field_values(self, from_item, to_item, fields):
+    @staticmethod
+    def get_copied_field_values(from_item, fields):
         field_values = {}
         for field_name in fields:
             if field_name in from_item.fields:
@@ -320,56 +2314,737 @@ class OpApi:
             else:
                 # I guess we're erasing this field. TODO: Prompt to confirm.
                 field_values[field_name] = ""
-        if field_values:
-            self.update_item(to_item, field_values)
+        return field_values
 
-    def archive_items(self, items_to_archive):
-        for item in items_to_archive:
-            self.archive_item(item.item_id)
+    def copy_field_values(self, from_item, to_item, fields):
+        if not from_item.has_plaintext():
+            from_item = self.get_plaintext_details([from_item])[0]
+        field_values = self.get_copied_field_values(from_item, fields)
+        if field_values:
+            return self.update_item(to_item, field_values)
+        return to_item
+
+    def archive_items(self, items_to_archive, reconcile=None):
+        """Archives many items concurrently under the rate limiter.
+
+        Archived items are dropped locally instead of re-listing after each
+        one. The list is refreshed once at the end if 'reconcile' is True, or
+        by default only if some archives failed and the account's state is
+        uncertain. Returns the ids that were archived.
+        """
+        archived_ids = []
+        failed_ids = []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.executor.max_in_flight
+        ) as executor:
+            futures = {
+                executor.submit(
+                    self.run_command,
+                    ["item", "delete", item.item_id, "--archive"],
+                    cacheable=False,
+                    vault_id=item.vault_id,
+                ): item.item_id
+                for item in items_to_archive
+            }
+            for future in concurrent.futures.as_completed(futures):
+                item_id = futures[future]
+                try:
+                    future.result()
+                except OpApiError as error:
+                    logging.error("Failed to archive %s: %s", item_id, error)
+                    failed_ids.append(item_id)
+                    continue
+                logging.warning("Archived item %s", item_id)
+                archived_ids.append(item_id)
+
+        self.item_store.delete_items(archived_ids)
+        self.apply_item_removals(archived_ids)
+        if reconcile or (reconcile is None and failed_ids):
+            self.refresh_item_ids()
+        return archived_ids
 
     def mark_as_multiprofile(self, items):
         for item in items:
             self.add_tag(item, MULTIPROFILE_TAG)
 
     def find_duplicates(self):
-        duplicates = []
-        duplicate_ids = set()
-        for i, details in enumerate(self.items):
-            item_id = details.item_id
-            if item_id in duplicate_ids:
-                logging.debug("Skipping known duplicate %s.", item_id)
-                continue
-            logging.debug("Looking for duplicates of %s", item_id)
-            if details and details.has_domains():
-                matching_items = []
-                for j_details in self.items[i + 1 :]:
-                    j_item_id = j_details.item_id
-                    if j_item_id in duplicate_ids:
-                        logging.debug(
-                            "Skipping known duplicate %s (inner loop).", j_item_id
-                        )
-                        continue
-                    if j_details.item_id == details.item_id:
-                        continue
-                    if not j_details.is_duplicate(details):
-                        continue
-                    matching_items.append(j_details)
-                if matching_items:
-                    duplicate_set = DuplicateSet(
-                        [details] + matching_items, op_api=self
-                    )
-                    if duplicate_set.is_intentionally_multiprofile():
-                        continue
-                    duplicates.append(duplicate_set)
-                    duplicate_ids.update([item.item_id for item in duplicate_set.items])
+        with self.items_lock:
+            if self.duplicate_index is None:
+                self.progress.start_phase("Grouping duplicates")
+                self.duplicate_index = DuplicateIndex(
+                    self.items, op_api=self, near_matcher=self.near_matcher
+                )
+        duplicates = self.duplicate_index.duplicate_sets()
 
         logging.info(
             "Found %s sets of duplicates involving %s items.",
             len(duplicates),
-            len(duplicate_ids),
+            sum(len(duplicate_set.items) for duplicate_set in duplicates),
         )
         return duplicates
 
+    def iter_scored_duplicates(
+        self, priority=BACKGROUND_PRIORITY, cancel_group=None
+    ):
+        """Yields lists of DuplicateSets as soon as each can be scored.
+
+        Sets whose scores are already known come first, in one list. The
+        rest are hydrated in bulk batches and yielded a batch at a time, so
+        the best candidates can be shown before the whole account is fetched.
+        A batch that can't be fetched is yielded unscored.
+        """
+        scored = []
+        unscored = []
+        for duplicate_set in self.find_duplicates():
+            if duplicate_set.get_cached_score() is None:
+                unscored.append(duplicate_set)
+            else:
+                scored.append(duplicate_set)
+        self.score_cache.flush()
+        if scored:
+            yield scored
+
+        for batch in self._batch_sets(unscored):
+            try:
+                self.hydrate_duplicate_sets(
+                    batch, priority=priority, cancel_group=cancel_group
+                )
+            except RequestCancelled:
+                return
+            except OpApiError as error:
+                logging.error("Scoring %s sets failed: %s", len(batch), error)
+            else:
+                for duplicate_set in batch:
+                    duplicate_set.difference_score()
+                self.score_cache.flush()
+            yield batch
+
+    def _batch_sets(self, duplicate_sets):
+        """Splits sets into runs of about BULK_BATCH_SIZE items."""
+        batch = []
+        batch_size = 0
+        for duplicate_set in duplicate_sets:
+            batch.append(duplicate_set)
+            batch_size += len(duplicate_set.items)
+            if batch_size >= self.BULK_BATCH_SIZE:
+                yield batch
+                batch = []
+                batch_size = 0
+        if batch:
+            yield batch
+
+
+class MutationJournal:
+    """Persistent queue of item mutations applied by a background worker.
+
+    Each mutation is written to the ItemStore before it is applied locally,
+    so the GUI can show its result straight away. A worker thread then
+    replays the queue against op under the rate limiter, and anything left
+    over when the app is killed is resumed by the next start().
+
+    In compact mode edits are only kept in memory, since their payloads can
+    hold passwords, so edits still queued when the app is killed are lost.
+    """
+
+    ARCHIVE = "archive"
+    UPDATE = "update"
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, op_api):
+        self.op_api = op_api
+        self.queue = queue.Queue()
+        self.worker = None
+        # Items with an archive queued; edits still queued for them are dropped.
+        self.archiving_ids = set()
+        # Entries kept only in memory get negative ids, and count attempts here.
+        self.unsaved_ids = itertools.count(-1, -1)
+        self.unsaved_attempts = {}
+
+    def start(self):
+        """Re-applies and resumes pending mutations, then starts the worker."""
+        pending = self.op_api.item_store.load_journal()
+        if pending:
+            logging.info("Resuming %s pending mutations.", len(pending))
+        if self.op_api.compact_cache:
+            pending = self._unsave_updates(pending)
+        for entry in pending:
+            self._apply_locally(entry)
+            self.queue.put(entry)
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def pending_count(self):
+        return self.queue.unfinished_tasks
+
+    def wait_until_idle(self):
+        self.queue.join()
+
+    def archive(self, item):
+        """Queues an archive and drops the item locally."""
+        self._record(self.ARCHIVE, item, {})
+
+    def update(self, item, fields):
+        """Queues an edit and returns the item as it will look afterwards."""
+        return self._record(self.UPDATE, item, {"fields": fields})
+
+    def _unsave_updates(self, pending):
+        """Moves edits saved before compact mode was turned on into memory."""
+        saved_ids = [entry[0] for entry in pending if entry[1] == self.UPDATE]
+        if not saved_ids:
+            return pending
+        self.op_api.item_store.drop_journal_entries(saved_ids)
+        return [
+            (next(self.unsaved_ids),) + entry[1:] if entry[1] == self.UPDATE else entry
+            for entry in pending
+        ]
+
+    def _record(self, action, item, payload):
+        if action == self.UPDATE and self.op_api.compact_cache:
+            entry_id = next(self.unsaved_ids)
+        else:
+            entry_id = self.op_api.item_store.append_journal_entry(
+                action, item.item_id, item.vault_id, payload
+            )
+        entry = (entry_id, action, item.item_id, item.vault_id, payload)
+        result = self._apply_locally(entry, item=item)
+        self.queue.put(entry)
+        return result
+
+    def _apply_locally(self, entry, item=None):
+        _, action, item_id, _, payload = entry
+        if action == self.ARCHIVE:
+            self.archiving_ids.add(item_id)
+            self.op_api.apply_item_removal(item_id)
+            return None
+        if item is None:
+            item = self.op_api.get_listed_item(item_id)
+        if item is None:
+            return None
+        updated = item.with_updates(payload["fields"])
+        self.op_api.apply_item_update(updated)
+        return updated
+
+    def _execute(self, action, item_id, vault_id, payload):
+        if action == self.ARCHIVE:
+            self.op_api.run_command(
+                ["item", "delete", item_id, "--archive"],
+                cacheable=False,
+                vault_id=vault_id,
+            )
+            self.op_api.item_store.delete_item(item_id)
+            self.op_api.apply_item_removal(item_id)
+            return
+        if item_id in self.archiving_ids:
+            logging.info("Skipping edit of %s, which is being archived.", item_id)
+            return
+        current = self.op_api.get_item_details(item_id, vault_id=vault_id)
+        self.op_api.update_item(current, payload["fields"])
+
+    def _reconcile(self, item_id, vault_id):
+        """Replaces an abandoned optimistic update with the real item."""
+        try:
+            self.op_api.get_item_details(item_id, force_refresh=True, vault_id=vault_id)
+        except OpApiError as error:
+            logging.error("Couldn't re-fetch %s: %s", item_id, error)
+
+    def _record_attempt(self, entry_id):
+        if entry_id < 0:
+            self.unsaved_attempts[entry_id] = self.unsaved_attempts.get(entry_id, 0) + 1
+            return self.unsaved_attempts[entry_id]
+        return self.op_api.item_store.record_journal_attempt(entry_id)
+
+    def _remove(self, entry_id):
+        if entry_id < 0:
+            self.unsaved_attempts.pop(entry_id, None)
+        else:
+            self.op_api.item_store.remove_journal_entry(entry_id)
+
+    def _retry_or_give_up(self, entry):
+        entry_id, action, item_id, vault_id, _ = entry
+        attempts = self._record_attempt(entry_id)
+        if attempts < self.MAX_ATTEMPTS:
+            self.queue.put(entry)
+        else:
+            logging.error("Giving up on %s %s.", action, item_id)
+            self._remove(entry_id)
+            if action == self.ARCHIVE:
+                self.archiving_ids.discard(item_id)
+                self.op_api.forget_item_removal(item_id)
+            self._reconcile(item_id, vault_id)
+
+    def _work(self):
+        while True:
+            entry = self.queue.get()
+            entry_id, action, item_id, _, _ = entry
+            try:
+                try:
+                    self._execute(*entry[1:])
+                    self._remove(entry_id)
+                except OpApiError as error:
+                    logging.error("Failed to %s %s: %s", action, item_id, error)
+                    self._retry_or_give_up(entry)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception(
+                        "Unexpected error trying to %s %s.", action, item_id
+                    )
+                    self._retry_or_give_up(entry)
+            except Exception:  # pylint: disable=broad-except
+                # The entry stays in the store, so the next start() retries it.
+                logging.exception("Couldn't record the outcome for %s.", item_id)
+            finally:
+                self.queue.task_done()
+
+
+class DetailPrefetcher:
+    """Hydrates duplicate sets in the order the user will see them.
+
+    Sets inside the viewport are fetched first, then up to 'lookahead' sets
+    past it. Moving the viewport re-prioritizes whatever hasn't been fetched
+    yet, and sets beyond the lookahead window wait until the user scrolls.
+    Fetches run at background priority, and pausing drops any still queued.
+    """
+
+    CANCEL_GROUP = "prefetch"
+
+    def __init__(self, op_api, lookahead=30, on_hydrated=None):
+        self.op_api = op_api
+        self.lookahead = lookahead
+        self.on_hydrated = on_hydrated
+        self.condition = threading.Condition()
+        self.duplicate_sets = []
+        self.failed_sets = set()
+        self.first_visible = 0
+        self.last_visible = 0
+        self.paused = False
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def set_sets(self, duplicate_sets):
+        """Replaces the list being viewed, in display order."""
+        with self.condition:
+            self.duplicate_sets = list(duplicate_sets)
+            self.failed_sets = set()
+            self.condition.notify()
+
+    def set_viewport(self, first_visible, last_visible):
+        """Records which list positions are currently on screen."""
+        with self.condition:
+            self.first_visible = max(0, first_visible)
+            self.last_visible = max(self.first_visible, last_visible)
+            self.condition.notify()
+
+    def pause(self):
+        """Stops prefetching and cancels fetches that haven't started yet."""
+        with self.condition:
+            self.paused = True
+        self.op_api.scheduler.cancel(self.CANCEL_GROUP)
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.condition.notify()
+
+    def _pending(self, start, end):
+        batch = []
+        batch_size = 0
+        for duplicate_set in self.duplicate_sets[start:end]:
+            if id(duplicate_set) in self.failed_sets:
+                continue
+            if duplicate_set.has_full_details():
+                continue
+            batch.append(duplicate_set)
+            batch_size += len(duplicate_set.items)
+            if batch_size >= self.op_api.BULK_BATCH_SIZE:
+                break
+        return batch
+
+    def _next_batch(self):
+        """Picks the next sets to hydrate, visible ones before lookahead ones."""
+        visible_end = self.last_visible + 1
+        return self._pending(self.first_visible, visible_end) or self._pending(
+            visible_end, visible_end + self.lookahead
+        )
+
+    def _work(self):
+        while True:
+            with self.condition:
+                batch = None if self.paused else self._next_batch()
+                while not batch:
+                    self.condition.wait()
+                    batch = None if self.paused else self._next_batch()
+            try:
+                self.op_api.hydrate_duplicate_sets(
+                    batch,
+                    priority=BACKGROUND_PRIORITY,
+                    cancel_group=self.CANCEL_GROUP,
+                )
+            except RequestCancelled:
+                logging.debug("Prefetch of %s sets cancelled.", len(batch))
+                continue
+            except Exception as error:  # pylint: disable=broad-except
+                if isinstance(error, OpApiError):
+                    logging.error("Prefetch of %s sets failed: %s", len(batch), error)
+                else:
+                    logging.exception("Prefetch of %s sets failed.", len(batch))
+                with self.condition:
+                    self.failed_sets.update(id(dup_set) for dup_set in batch)
+                continue
+            try:
+                for duplicate_set in batch:
+                    duplicate_set.difference_score()
+                self.op_api.score_cache.flush()
+                if self.on_hydrated:
+                    self.on_hydrated(batch)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Couldn't score %s prefetched sets.", len(batch))
+
+
+class NearDuplicateMatcher:
+    """Finds likely duplicates among items with no URLs, using MinHash and LSH.
+
+    Each item is reduced to a set of shingles: three-character slices of its
+    normalized title, plus the additional information op lists for it, such
+    as a login's username. Only listing fields are used, so an item hashes
+    the same whether or not its details have been fetched, and grouping
+    doesn't depend on what earlier runs happened to cache. A MinHash
+    signature estimates the Jaccard similarity of two such sets, and
+    splitting signatures into bands means only items that share a band are
+    ever compared, so candidates are found without an all-pairs scan.
+    Candidates are confirmed with the full signature against 'threshold'.
+    """
+
+    DEFAULT_THRESHOLD = 0.8
+    DEFAULT_NUM_PERM = 64
+    SHINGLE_SIZE = 3
+
+    def __init__(
+        self,
+        threshold=DEFAULT_THRESHOLD,
+        num_perm=DEFAULT_NUM_PERM,
+        bands=None,
+        seed=b"",
+    ):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands or self.choose_bands(threshold, num_perm)
+        if num_perm % self.bands:
+            raise ValueError(
+                f"{num_perm} permutations can't be split into {self.bands} bands"
+            )
+        self.rows = num_perm // self.bands
+        self.seed = seed
+
+    @staticmethod
+    def choose_bands(threshold, num_perm):
+        """Picks the band count whose LSH threshold is closest below 'threshold'.
+
+        Items with similarity s share a band with probability
+        1 - (1 - s**rows)**bands, which rises steeply around
+        (1 / bands)**(1 / rows), so that point should sit just under the
+        threshold the candidates are confirmed against.
+        """
+        layouts = [
+            (bands, num_perm // bands)
+            for bands in range(1, num_perm + 1)
+            if num_perm % bands == 0
+        ]
+        below = [
+            (bands, rows)
+            for bands, rows in layouts
+            if (1 / bands) ** (1 / rows) <= threshold
+        ]
+        if not below:
+            return num_perm
+        return max(below, key=lambda layout: (1 / layout[0]) ** (1 / layout[1]))[0]
+
+    def get_shingles(self, item):
+        shingles = set()
+        for field_name, prefix in (("title", ""), ("additional_information", "info:")):
+            text = " ".join(
+                re.findall(r"\w+", (item.fields.get(field_name) or "").lower())
+            )
+            shingles.update(
+                prefix + text[i : i + self.SHINGLE_SIZE]
+                for i in range(len(text) - self.SHINGLE_SIZE + 1)
+            )
+            if 0 < len(text) < self.SHINGLE_SIZE:
+                shingles.add(prefix + text)
+        return shingles
+
+    def get_signature(self, item):
+        """Returns the item's MinHash signature, or None if it has nothing to hash.
+
+        One SHAKE-128 digest per shingle supplies a 32-bit hash for every
+        permutation at once, so the signature is an element-wise min that
+        runs in C rather than a Python loop per permutation.
+        """
+        digest_size = 4 * self.num_perm
+        hash_rows = [
+            array.array(
+                "I", hashlib.shake_128(self.seed + shingle.encode()).digest(digest_size)
+            )
+            for shingle in self.get_shingles(item)
+        ]
+        if not hash_rows:
+            return None
+        return array.array("I", map(min, *hash_rows))
+
+    def get_band_keys(self, signature):
+        """Returns one bucket key per band; items sharing any key are candidates."""
+        rows = self.rows
+        return [
+            hash((band,) + tuple(signature[band * rows : (band + 1) * rows]))
+            for band in range(self.bands)
+        ]
+
+    def get_similarity(self, signature, other_signature):
+        """Estimates the Jaccard similarity of the two items' shingles."""
+        matches = sum(map(operator.eq, signature, other_signature))
+        return matches / self.num_perm
+
+    def is_similar(self, signature, other_signature):
+        return self.get_similarity(signature, other_signature) >= self.threshold
+
+
+class DuplicateIndex:
+    """Live inverted index from domains to the items that reference them.
+
+    Items that share any domain, directly or through a chain of other items,
+    are merged into the same group with a union-find pass over the index, so
+    the initial grouping is linear in the number of (item, domain) pairs.
+    Afterwards, item-level deltas only regroup the groups they touch.
+
+    Given a NearDuplicateMatcher, items without URLs are indexed by their
+    LSH bands instead, and grouped with the first earlier item they're
+    similar to that isn't itself in another item's group.
+    """
+
+    # Seeds per LSH bucket that later members are compared with.
+    BUCKET_SEEDS = 4
+
+    def __init__(self, items, op_api=None, near_matcher=None):
+        self.op_api = op_api
+        self.near_matcher = near_matcher
+        self.lock = threading.RLock()
+        self.items = {}
+        self.item_order = {}
+        self.domain_index = collections.defaultdict(set)
+        self.signatures = {}
+        self.band_keys = {}
+        self.band_index = collections.defaultdict(set)
+        self.group_keys = {}
+        self.group_sets = {}
+        for item in items:
+            self._add_to_index(item)
+        self._regroup(self.items.keys())
+
+    def _add_to_index(self, item):
+        if item.has_domains():
+            for domain in item.domains:
+                self.domain_index[domain].add(item.item_id)
+        else:
+            signature = None
+            if self.near_matcher is not None:
+                signature = self.near_matcher.get_signature(item)
+            if signature is None:
+                return False
+            band_keys = self.near_matcher.get_band_keys(signature)
+            self.signatures[item.item_id] = signature
+            self.band_keys[item.item_id] = band_keys
+            for band_key in band_keys:
+                self.band_index[band_key].add(item.item_id)
+        self.items[item.item_id] = item
+        self.item_order.setdefault(item.item_id, len(self.item_order))
+        return True
+
+    def _remove_from_index(self, item_id):
+        item = self.items.pop(item_id)
+        for domain in item.domains:
+            self.domain_index[domain].discard(item_id)
+            if not self.domain_index[domain]:
+                del self.domain_index[domain]
+        self.signatures.pop(item_id, None)
+        for band_key in self.band_keys.pop(item_id, ()):
+            self.band_index[band_key].discard(item_id)
+            if not self.band_index[band_key]:
+                del self.band_index[band_key]
+
+    def _iter_candidate_ids(self, item_id):
+        """Yields the ids that share a domain with item_id."""
+        for domain in self.items[item_id].domains:
+            yield from self.domain_index[domain]
+
+    def _pop_band_component(self, band_keys, known_items):
+        """Pops the groups of every item linked to band_keys by shared bands.
+
+        Which seed a near-duplicate joins depends on every earlier item it
+        shares a band with, so the whole component is regrouped to get the
+        same sets as indexing from scratch.
+        """
+        pending_keys = list(band_keys)
+        seen_keys = set(pending_keys)
+        while pending_keys:
+            for item_id in self.band_index.get(pending_keys.pop(), ()):
+                if item_id in known_items:
+                    continue
+                known_items.update(self._pop_group(item_id))
+                for band_key in self.band_keys[item_id]:
+                    if band_key not in seen_keys:
+                        seen_keys.add(band_key)
+                        pending_keys.append(band_key)
+
+    def _pop_group(self, item_id):
+        """Forgets the group containing item_id and returns its members."""
+        group_key = self.group_keys.get(item_id)
+        if group_key is None:
+            return {item_id: self.items.get(item_id)}
+        duplicate_set = self.group_sets.pop(group_key)
+        members = {item.item_id: item for item in duplicate_set.items}
+        for member_id in members:
+            del self.group_keys[member_id]
+        return members
+
+    @staticmethod
+    def _find(parents, item_id):
+        root = item_id
+        while parents[root] != root:
+            root = parents[root]
+        while parents[item_id] != root:
+            parents[item_id], item_id = root, parents[item_id]
+        return root
+
+    def _union_near_duplicates(self, parents):
+        """Groups the near-duplicates in parents around seed items.
+
+        Items are walked in item order. Each joins the group of the first
+        earlier seed it shares a band with and is confirmed similar to, or
+        becomes a seed itself. Every member is then similar to its group's
+        seed, so unrelated items aren't merged through a chain of look-alikes,
+        and the result doesn't depend on set iteration order. A bucket of n
+        look-alike items costs n comparisons rather than n**2, since only the
+        first few seeds in each bucket are kept.
+        """
+        near_ids = sorted(
+            (item_id for item_id in parents if item_id in self.signatures),
+            key=self.item_order.__getitem__,
+        )
+        bucket_seeds = collections.defaultdict(list)
+        for item_id in near_ids:
+            signature = self.signatures[item_id]
+            band_keys = self.band_keys[item_id]
+            compared = set()
+            for band_key in band_keys:
+                for seed_id in bucket_seeds[band_key]:
+                    if seed_id in compared:
+                        continue
+                    compared.add(seed_id)
+                    seed_signature = self.signatures[seed_id]
+                    if self.near_matcher.is_similar(seed_signature, signature):
+                        parents[item_id] = seed_id
+                        break
+                else:
+                    continue
+                break
+            else:
+                for band_key in band_keys:
+                    seeds = bucket_seeds[band_key]
+                    if len(seeds) < self.BUCKET_SEEDS:
+                        seeds.append(item_id)
+
+    def _regroup(self, item_ids, known_items=None):
+        """Regroups a set of item ids that is closed under shared domains.
+
+        It must also hold every item that shares an LSH band with them.
+        """
+        parents = {item_id: item_id for item_id in item_ids}
+        domains = set()
+        for item_id in parents:
+            domains.update(self.items[item_id].domains)
+        for domain in domains:
+            domain_item_ids = iter(self.domain_index[domain])
+            first_root = self._find(parents, next(domain_item_ids))
+            for item_id in domain_item_ids:
+                root = self._find(parents, item_id)
+                if root != first_root:
+                    parents[root] = first_root
+        if self.signatures:
+            self._union_near_duplicates(parents)
+
+        groups = collections.defaultdict(list)
+        for item_id in parents:
+            groups[self._find(parents, item_id)].append(item_id)
+        known_items = known_items or {}
+        for member_ids in groups.values():
+            if len(member_ids) < 2:
+                continue
+            member_ids.sort(key=self.item_order.__getitem__)
+            items = []
+            for member_id in member_ids:
+                # Prefer the copies that earlier sets already hydrated.
+                item = known_items.get(member_id)
+                if item is None or not item.has_full_details():
+                    item = self.items[member_id]
+                items.append(item)
+                self.group_keys[member_id] = member_ids[0]
+            self.group_sets[member_ids[0]] = DuplicateSet(items, op_api=self.op_api)
+
+    def update_item(self, item):
+        """Adds or replaces an item, regrouping only the sets it touches."""
+        with self.lock:
+            known_items = {}
+            band_keys = list(self.band_keys.get(item.item_id, ()))
+            if item.item_id in self.items:
+                known_items.update(self._pop_group(item.item_id))
+                self._remove_from_index(item.item_id)
+            if self._add_to_index(item):
+                for other_id in list(self._iter_candidate_ids(item.item_id)):
+                    if other_id not in known_items:
+                        known_items.update(self._pop_group(other_id))
+                band_keys += self.band_keys.get(item.item_id, ())
+            self._pop_band_component(band_keys, known_items)
+            known_items.pop(item.item_id, None)
+            affected_ids = set(known_items)
+            if item.item_id in self.items:
+                affected_ids.add(item.item_id)
+            self._regroup(affected_ids, known_items=known_items)
+
+    def remove_item(self, item_id):
+        """Drops an item, splitting or dissolving the set it belonged to."""
+        with self.lock:
+            if item_id not in self.items:
+                return
+            band_keys = self.band_keys.get(item_id, ())
+            known_items = self._pop_group(item_id)
+            del known_items[item_id]
+            self._remove_from_index(item_id)
+            self._pop_band_component(band_keys, known_items)
+            self._regroup(known_items.keys(), known_items=known_items)
+
+    def groups(self):
+        """Returns lists of duplicate items, in original item order."""
+        return [duplicate_set.items for duplicate_set in self._ordered_sets()]
+
+    def _ordered_sets(self):
+        with self.lock:
+            return [
+                self.group_sets[group_key]
+                for group_key in sorted(self.group_sets, key=self.item_order.get)
+            ]
+
+    def contains(self, duplicate_set):
+        """Whether duplicate_set is still one of the index's current groups."""
+        with self.lock:
+            group_key = self.group_keys.get(duplicate_set.items[0].item_id)
+            return self.group_sets.get(group_key) is duplicate_set
+
+    def duplicate_sets(self):
+        """Returns the current DuplicateSets, minus intentional multiprofiles."""
+        return [
+            duplicate_set
+            for duplicate_set in self._ordered_sets()
+            if not duplicate_set.is_intentionally_multiprofile()
+        ]
+
 
 class DuplicateSet:
     """Container for a set of 1Password duplicate items."""
@@ -377,9 +3052,23 @@ class DuplicateSet:
     def __init__(self, items, op_api=None):
         self.op_api = op_api
         self.items = items
+        self.score = None
 
     def get_display_name(self):
-        return max(self.items[0].get_shared_domains(self.items[1]))
+        shared_domains = self.items[0].get_shared_domains(self.items[1])
+        if not shared_domains:
+            # Sets merged through a chain of items may not have a domain in
+            # common between their first two members.
+            domain_counts = collections.Counter(
+                domain for item in self.items for domain in item.domains
+            )
+            shared_domains = {
+                domain for domain, count in domain_counts.items() if count > 1
+            }
+        if not shared_domains:
+            # Near-duplicates without URLs are matched on their titles.
+            return self.items[0].fields.get("title") or self.items[0].item_id
+        return max(shared_domains)
 
     def has_full_details(self):
         return all(item.has_full_details() for item in self.items)
@@ -388,13 +3077,12 @@ class DuplicateSet:
         if self.has_full_details():
             return
 
-        for i, item in enumerate(self.items[:]):
-            if item.has_full_details():
-                continue
-            new_item = self.op_api.get_item_details(
-                item.item_id, vault_id=item.vault_id
-            )
-            self.items[i] = new_item
+        self.items[:] = self.op_api.get_items_details(self.items)
+
+    def get_plaintext_items(self):
+        """Returns the set's items with real field values, for display."""
+        self.force_full_details()
+        return self.op_api.get_plaintext_details(self.items)
 
     @cached_property
     def field_names(self):
@@ -414,21 +3102,51 @@ class DuplicateSet:
     def is_intentionally_multiprofile(self):
         return all(MULTIPROFILE_TAG in item.fields["tags"] for item in self.items)
 
+    def get_score_key(self):
+        """Identifies this exact revision of every item in the set."""
+        return ";".join(
+            sorted(
+                f"{item.item_id}@{item.fields.get('updated_at', '')}"
+                for item in self.items
+            )
+        )
+
+    def get_cached_score(self):
+        """Returns the score if it's known without fetching any details."""
+        if self.score is None and self.has_full_details():
+            return self.difference_score()
+        if self.score is None and self.op_api is not None:
+            self.score = self.op_api.score_cache.get(self.get_score_key())
+        return self.score
+
+    def sort_key(self):
+        """Orders sets by known score, with sets that aren't scored yet last."""
+        score = self.get_cached_score()
+        return (score is None, score or 0)
+
     def difference_score(self):
-        score = 0
-        for field_name in self.field_names:
-            existing_values = set()
-            for i in range(len(self.items)):
-                for k in range(len(self.field_values[i])):
-                    item_value = self.field_values[i][k]
-                    if hasattr(item_value, "__iter__") and not isinstance(
-                        item_value, str
-                    ):
-                        for element in item_value:
-                            existing_values.add(element)
-                    else:
-                        existing_values.add(item_value)
+        if self.score is not None:
+            return self.score
+        score_cache = self.op_api.score_cache if self.op_api else None
+        score_key = self.get_score_key()
+        if score_cache is not None:
+            self.score = score_cache.get(score_key)
+        if self.score is None:
+            self.score = self._compute_difference_score()
+            if score_cache is not None:
+                score_cache.put(score_key, self.score)
+        return self.score
+
+    def _compute_difference_score(self):
+        distinct_values = [set() for _ in self.field_names]
+        for row in self.field_values:
+            for existing_values, item_value in zip(distinct_values, row):
+                if isinstance(item_value, list):
+                    item_value = tuple(item_value)
+                existing_values.add(item_value)
 
+        score = 0
+        for field_name, existing_values in zip(self.field_names, distinct_values):
             row_has_diff_values = len(existing_values) > 1
             if row_has_diff_values:
                 field_score = len(existing_values)
@@ -438,7 +3156,11 @@ class DuplicateSet:
                     field_score *= 10
                 elif field_name.lower() == "username":
                     field_score *= 5
-                elif field_name.lower in ["vault", "updated_at"]:
+                elif field_name.lower() in [
+                    "vault",
+                    "updated_at",
+                    "additional_information",
+                ]:
                     field_score /= 2
                 score += field_score
         return score
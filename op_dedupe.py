@@ -13,6 +13,7 @@ try:
 except ModuleNotFoundError:
     KIVY_ENABLED = False
 import gui_tkinter
+import op_api
 
 
 def init_argparse():
@@ -20,6 +21,42 @@ def init_argparse():
         description="Find and manage duplicate items in 1Password."
     )
     parser.add_argument("--vault", type=str, help="Act only on this vault.")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Re-fetch cached items that changed since the last run.",
+    )
+    parser.add_argument(
+        "--prefetch_lookahead",
+        type=int,
+        default=30,
+        help="How many sets past the visible ones to fetch details for.",
+    )
+    parser.add_argument(
+        "--compact_cache",
+        action="store_true",
+        help="Cache only keyed digests of secret field values, not the values.",
+    )
+    parser.add_argument(
+        "--group_by",
+        choices=op_api.DOMAIN_GRANULARITIES,
+        default=op_api.REGISTRABLE_DOMAIN_GRANULARITY,
+        help="Treat URLs as the same site when they share this part of the host.",
+    )
+    parser.add_argument(
+        "--near_duplicate_threshold",
+        type=float,
+        default=op_api.NEAR_DUPLICATE_THRESHOLD,
+        help="How similar items without URLs must be to group them, from 0 to 1. "
+        "The default, 0, only groups items by URL; "
+        f"{op_api.NearDuplicateMatcher.DEFAULT_THRESHOLD} is a good place to start.",
+    )
+    parser.add_argument(
+        "--op_path",
+        type=str,
+        default="op",
+        help="The 1Password CLI to run, such as ./fake_op.py for testing.",
+    )
     parser.add_argument(
         "--use_kivy",
         action="store_true",
@@ -44,9 +81,24 @@ def main():
         vault = args.vault
 
     if KIVY_ENABLED and args.use_kivy:
-        tool = gui_kivy.KivyGUI(vault)
+        tool = gui_kivy.KivyGUI(
+            vault,
+            sync=args.sync,
+            prefetch_lookahead=args.prefetch_lookahead,
+            compact_cache=args.compact_cache,
+            domain_granularity=args.group_by,
+            near_duplicate_threshold=args.near_duplicate_threshold,
+            op_path=args.op_path,
+        )
     else:
-        tool = gui_tkinter.TkinterGUI(vault)
+        tool = gui_tkinter.TkinterGUI(
+            vault,
+            sync=args.sync,
+            compact_cache=args.compact_cache,
+            domain_granularity=args.group_by,
+            near_duplicate_threshold=args.near_duplicate_threshold,
+            op_path=args.op_path,
+        )
     tool.run()
 
 
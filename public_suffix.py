@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""Find registrable domains (eTLD+1) with an offline copy of the Public Suffix List."""
+
+import argparse
+import functools
+import ipaddress
+import logging
+import os
+import sys
+
+PUBLIC_SUFFIX_LIST_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "public_suffix_list.dat"
+)
+
+
+def init_argparse():
+    parser = argparse.ArgumentParser(
+        description="Print the registrable domain of each host name."
+    )
+    parser.add_argument("hosts", nargs="+", help="Host names to look up.")
+    parser.add_argument(
+        "--list_path",
+        type=str,
+        default=PUBLIC_SUFFIX_LIST_PATH,
+        help="A public_suffix_list.dat to use instead of the bundled one.",
+    )
+    return parser
+
+
+def iter_rules(lines):
+    """Yields the rules in Public Suffix List text, skipping comments."""
+    for line in lines:
+        rule = line.split(None, 1)[0] if line.strip() else ""
+        if rule and not rule.startswith("//"):
+            yield rule
+
+
+def to_ascii(label):
+    """Returns the punycode form of a label, or the label if it can't be encoded."""
+    try:
+        return label.encode("idna").decode("ascii")
+    except UnicodeError:
+        return label
+
+
+class PublicSuffixTrie:
+    """Public Suffix List rules compiled into a trie of reversed labels.
+
+    Each node is a dict of child labels. A node that ends a rule also maps
+    RULE_END to True for a normal rule or False for an exception ("!") rule.
+    Rules are stored in both their Unicode and punycode spellings, since
+    hosts can arrive in either.
+    """
+
+    RULE_END = None
+    WILDCARD = "*"
+
+    def __init__(self, rules):
+        self.root = {}
+        for rule in rules:
+            is_exception = rule.startswith("!")
+            rule = rule.lstrip("!").lower()
+            self._add(rule.split("."), not is_exception)
+            ascii_labels = [to_ascii(label) for label in rule.split(".")]
+            self._add(ascii_labels, not is_exception)
+
+    def _add(self, labels, is_rule):
+        node = self.root
+        for label in reversed(labels):
+            node = node.setdefault(label, {})
+        node[self.RULE_END] = is_rule
+
+    @classmethod
+    def from_file(cls, path=PUBLIC_SUFFIX_LIST_PATH):
+        with open(path, encoding="utf-8") as list_file:
+            return cls(iter_rules(list_file))
+
+    def get_suffix_length(self, labels):
+        """Returns how many trailing labels of a host form its public suffix.
+
+        Follows the list's algorithm: exception rules win, then the longest
+        matching rule, and an unlisted TLD counts as a one-label suffix.
+        """
+        suffix_length = 1
+        node = self.root
+        for depth, label in enumerate(reversed(labels), 1):
+            wildcard = node.get(self.WILDCARD)
+            node = node.get(label)
+            if node is not None and node.get(self.RULE_END) is False:
+                return depth - 1
+            if (node is not None and node.get(self.RULE_END)) or (
+                wildcard is not None and wildcard.get(self.RULE_END)
+            ):
+                suffix_length = depth
+            if node is None:
+                break
+        return suffix_length
+
+    def get_registrable_domain(self, host):
+        """Returns the public suffix plus one label, e.g. example.co.uk.
+
+        Hosts that are IP addresses, single labels or public suffixes
+        themselves have no registrable domain, so they're returned as-is.
+        """
+        host = host.rstrip(".").lower()
+        if not host or is_ip_address(host):
+            return host
+        labels = host.split(".")
+        suffix_length = self.get_suffix_length(labels)
+        if len(labels) <= suffix_length:
+            return host
+        return ".".join(labels[-suffix_length - 1 :])
+
+
+def is_ip_address(host):
+    # Host names end in a letter, so most hosts can skip the full parse.
+    if ":" not in host and not host[-1].isdigit():
+        return False
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def get_default_trie():
+    """Compiles the bundled list once, on first use."""
+    return PublicSuffixTrie.from_file()
+
+
+@functools.lru_cache(maxsize=65536)
+def get_registrable_domain(host):
+    """Returns a host's registrable domain according to the bundled list."""
+    return get_default_trie().get_registrable_domain(host)
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s:%(levelname)s:%(message)s",
+        stream=sys.stderr,
+    )
+
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    trie = PublicSuffixTrie.from_file(args.list_path)
+    for host in args.hosts:
+        print(f"{host}\t{trie.get_registrable_domain(host)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Tests for the scheduler, the duplicate index and the mutation journal."""
+
+import json
+import os
+import random
+import threading
+import time
+
+import pytest
+
+import op_api
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_OP_PATH = os.path.join(REPO_DIR, "fake_op.py")
+TIMEOUT_SECONDS = 10
+
+
+def wait_for(predicate):
+    deadline = time.monotonic() + TIMEOUT_SECONDS
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the scheduler.")
+        time.sleep(0.01)
+
+
+def block_worker(scheduler):
+    """Occupies a one-worker scheduler until the returned event is set."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(TIMEOUT_SECONDS)
+
+    scheduler.submit(blocker)
+    assert started.wait(TIMEOUT_SECONDS)
+    return release
+
+
+def make_rate_limiter(burst):
+    # A long window means the bucket barely refills while a test runs.
+    return op_api.RateLimiter({op_api.READ_OPERATION: [(burst * 10, 3600)]})
+
+
+def test_scheduler_runs_interactive_requests_first():
+    scheduler = op_api.CommandScheduler(workers=1)
+    release = block_worker(scheduler)
+    order = []
+    futures = [
+        scheduler.submit(
+            lambda name=name: order.append(name),
+            priority=priority,
+        )
+        for name, priority in [
+            ("background 1", op_api.BACKGROUND_PRIORITY),
+            ("interactive", op_api.INTERACTIVE_PRIORITY),
+            ("background 2", op_api.BACKGROUND_PRIORITY),
+        ]
+    ]
+    release.set()
+    for future in futures:
+        future.result(TIMEOUT_SECONDS)
+
+    assert order == ["interactive", "background 1", "background 2"]
+
+
+def test_scheduler_cancel_drops_only_its_group():
+    scheduler = op_api.CommandScheduler(workers=1)
+    release = block_worker(scheduler)
+    prefetches = [
+        scheduler.submit(
+            lambda: "prefetched",
+            priority=op_api.BACKGROUND_PRIORITY,
+            cancel_group="prefetch",
+        )
+        for _ in range(2)
+    ]
+    other = scheduler.submit(lambda: "kept", priority=op_api.BACKGROUND_PRIORITY)
+
+    assert scheduler.cancel("prefetch") == 2
+    release.set()
+
+    assert all(future.cancelled() for future in prefetches)
+    assert other.result(TIMEOUT_SECONDS) == "kept"
+    assert scheduler.stats()["background"]["cancelled"] == 2
+
+
+def test_scheduler_admits_by_priority_and_refunds_cancelled_payments():
+    rate_limiter = make_rate_limiter(burst=3)
+    scheduler = op_api.CommandScheduler(workers=1, rate_limiter=rate_limiter)
+    release = block_worker(scheduler)
+    bulk = scheduler.submit(
+        lambda: "bulk",
+        priority=op_api.BACKGROUND_PRIORITY,
+        cancel_group="prefetch",
+        operation=op_api.READ_OPERATION,
+        cost=5,
+    )
+    interactive = scheduler.submit(
+        lambda: "interactive", operation=op_api.READ_OPERATION, cost=2
+    )
+    release.set()
+
+    # The interactive request is paid first, though it was queued second.
+    assert interactive.result(TIMEOUT_SECONDS) == "interactive"
+    # The bulk request collects the one token left, then waits for more.
+    wait_for(lambda: sum(scheduler.paid.values()) == 1)
+    assert not bulk.done()
+    assert rate_limiter.take_available(op_api.READ_OPERATION, 3) == 0
+
+    assert scheduler.cancel("prefetch") == 1
+    assert bulk.cancelled()
+    assert scheduler.paid == {}
+    assert rate_limiter.take_available(op_api.READ_OPERATION, 3) == 1
+
+
+def make_listed_item(item_id, title, urls=(), additional_information=""):
+    return op_api.ItemDetails.from_list(
+        {
+            "id": item_id,
+            "title": title,
+            "tags": [],
+            "urls": [{"href": url} for url in urls],
+            "vault": {"id": "vault0", "name": "Private"},
+            "category": "LOGIN",
+            "updated_at": "2023-01-01T00:00:00Z",
+            "additional_information": additional_information,
+        }
+    )
+
+
+def make_random_item(rng, item_id):
+    """Returns an item that often shares a site or a title with others."""
+    if rng.random() < 0.5:
+        urls = [
+            f"https://{rng.choice(['www', 'login', 'app'])}.site{rng.randrange(30)}.com"
+            for _ in range(rng.randrange(1, 3))
+        ]
+        return make_listed_item(item_id, f"Site {item_id}", urls)
+    title = rng.choice(["Recovery codes", "Home wifi", "Passport", "Bank PIN"])
+    if rng.random() < 0.3:
+        title += f" {rng.randrange(3)}"
+    username = rng.choice(["", "alice", "bob"])
+    return make_listed_item(item_id, title, additional_information=username)
+
+
+def get_group_ids(duplicate_index):
+    return [[item.item_id for item in items] for items in duplicate_index.groups()]
+
+
+def test_duplicate_index_deltas_match_a_rebuild():
+    rng = random.Random(0)
+    near_matcher = op_api.NearDuplicateMatcher()
+    items = {f"id{i}": make_random_item(rng, f"id{i}") for i in range(200)}
+    duplicate_index = op_api.DuplicateIndex(
+        items.values(), near_matcher=near_matcher
+    )
+    for _ in range(150):
+        item_id = f"id{rng.randrange(250)}"
+        if item_id in items and rng.random() < 0.3:
+            duplicate_index.remove_item(item_id)
+            del items[item_id]
+        else:
+            items[item_id] = make_random_item(rng, item_id)
+            duplicate_index.update_item(items[item_id])
+
+    item_order = duplicate_index.item_order
+    rebuilt = op_api.DuplicateIndex(
+        sorted(items.values(), key=lambda item: item_order[item.item_id]),
+        near_matcher=near_matcher,
+    )
+    assert get_group_ids(duplicate_index) == get_group_ids(rebuilt)
+    assert any(len(group) > 2 for group in get_group_ids(rebuilt))
+
+
+def test_near_duplicates_are_grouped_around_their_first_item():
+    near_matcher = op_api.NearDuplicateMatcher()
+    items = [
+        make_listed_item("a", "Recovery codes", additional_information="github"),
+        make_listed_item("b", "Recovery codes", additional_information="google"),
+        make_listed_item("c", "Recovery codes", additional_information="github"),
+        make_listed_item("d", "Home wifi"),
+        make_listed_item("e", "Home WiFi"),
+    ]
+    duplicate_index = op_api.DuplicateIndex(items, near_matcher=near_matcher)
+
+    assert get_group_ids(duplicate_index) == [["a", "c"], ["d", "e"]]
+
+
+@pytest.fixture
+def fake_op_api(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_OP_STATE", str(tmp_path / "vault.json"))
+    monkeypatch.setenv("FAKE_OP_ITEMS", "10")
+    api = op_api.OpApi(cache_dir=str(tmp_path / "cache"), op_path=FAKE_OP_PATH)
+    yield api
+    api.item_store.close()
+
+
+def read_fake_vault(tmp_path):
+    with open(tmp_path / "vault.json", encoding="utf-8") as vault_file:
+        return json.load(vault_file)["items"]
+
+
+def test_journal_archive_wins_over_an_edit_queued_before_it(fake_op_api, tmp_path):
+    item = fake_op_api.items[0]
+    # Left by a run that was killed before either went through.
+    item_store = fake_op_api.item_store
+    item_store.append_journal_entry(
+        op_api.MutationJournal.UPDATE,
+        item.item_id,
+        item.vault_id,
+        {"fields": {"title": "Edited"}},
+    )
+    item_store.append_journal_entry(
+        op_api.MutationJournal.ARCHIVE, item.item_id, item.vault_id, {}
+    )
+
+    journal = op_api.MutationJournal(fake_op_api)
+    journal.start()
+    journal.wait_until_idle()
+
+    assert item.item_id not in read_fake_vault(tmp_path)
+    assert fake_op_api.get_listed_item(item.item_id) is None
+    assert item_store.load_journal() == []
+
+
+def test_journal_edit_then_archive_keeps_the_item_archived(fake_op_api, tmp_path):
+    archived, edited = fake_op_api.items[0], fake_op_api.items[1]
+    journal = op_api.MutationJournal(fake_op_api)
+    journal.start()
+
+    journal.update(archived, {"title": "Edited"})
+    journal.archive(archived)
+    journal.update(edited, {"title": "Kept"})
+    journal.wait_until_idle()
+
+    vault = read_fake_vault(tmp_path)
+    assert archived.item_id not in vault
+    assert fake_op_api.get_listed_item(archived.item_id) is None
+    assert vault[edited.item_id]["title"] == "Kept"
+    assert fake_op_api.get_listed_item(edited.item_id).fields["title"] == "Kept"
+    assert fake_op_api.item_store.load_journal() == []